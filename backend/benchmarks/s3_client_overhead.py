@@ -0,0 +1,78 @@
+"""
+Measure the per-request overhead removed by sharing one S3 client.
+
+Compares building a fresh boto3 client for every request (the old get_s3
+behaviour) with reusing the client created once in the app lifespan. With
+--bucket each simulated request also makes a HeadBucket call, which adds the
+cost of a new TLS connection for fresh clients versus a pooled keep-alive one.
+
+Run from the backend directory:
+
+    python -m benchmarks.s3_client_overhead --requests 200
+    S3_ENDPOINT_URL=http://localhost:9000 python -m benchmarks.s3_client_overhead --bucket test
+"""
+
+import time
+import argparse
+import statistics
+
+from typing import Callable, List
+
+from core.s3_client import create_s3_client
+
+
+def measure(request: Callable[[], None], requests: int) -> List[float]:
+    """Run a simulated request repeatedly and return each duration in ms."""
+    durations = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        request()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def report(label: str, durations: List[float]):
+    durations = sorted(durations)
+    p95 = durations[int(len(durations) * 0.95) - 1]
+    print(
+        f"{label:<16} mean {statistics.mean(durations):8.3f} ms  "
+        f"p50 {statistics.median(durations):8.3f} ms  p95 {p95:8.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--bucket", help="also call HeadBucket on this bucket")
+    args = parser.parse_args()
+
+    def per_request_client():
+        client = create_s3_client()
+        if args.bucket:
+            client.head_bucket(Bucket=args.bucket)
+        client.close()
+
+    shared = create_s3_client()
+
+    def shared_client():
+        if args.bucket:
+            shared.head_bucket(Bucket=args.bucket)
+
+    # Warm up imports, endpoint resolution and the shared connection pool
+    per_request_client()
+    shared_client()
+
+    fresh = measure(per_request_client, args.requests)
+    reused = measure(shared_client, args.requests)
+
+    report("per-request", fresh)
+    report("shared", reused)
+    print(
+        f"overhead removed per request: "
+        f"{statistics.mean(fresh) - statistics.mean(reused):.3f} ms"
+    )
+    shared.close()
+
+
+if __name__ == "__main__":
+    main()
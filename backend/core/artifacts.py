@@ -0,0 +1,325 @@
+import os
+import sys
+import time
+import asyncio
+import orjson
+
+from collections import OrderedDict
+from logsim import CustomLogger
+from botocore.exceptions import ClientError
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from core.responses import encode_json
+from core.s3_client import AsyncS3Client
+
+log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
+
+# Upper bound on the memory held by parsed artifacts per worker, as estimated
+# by deep_sizeof (parsed JSON takes several times its raw size)
+ARTIFACT_CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Seconds a cached artifact is served before its ETag is checked again
+ARTIFACT_CACHE_FRESHNESS = float(os.getenv("ARTIFACT_CACHE_FRESHNESS", 30))
+
+# Whole-transaction artifacts written by the flow
+QUALITY_KEY = "{transaction_id}/quality_result/quality.json"
+RESULTS_KEY = "{transaction_id}/processed_results/results.json"
+# Per-file objects split out of them once the flow succeeds
+QUALITY_FILE_KEY = "{transaction_id}/quality_result/files/{file_name}.json"
+RESULTS_FILE_KEY = "{transaction_id}/processed_results/files/{file_name}.json"
+
+
+class Artifact(NamedTuple):
+    """A parsed S3 object indexed by file name."""
+
+    etag: str
+    files: Dict[str, Any]
+    # Estimated in-memory size of files
+    size: int
+    checked_at: float
+
+
+def deep_sizeof(value: Any) -> int:
+    """
+    Estimate the memory held by parsed JSON: the sizes of every dict, list
+    and scalar reachable from value, counting shared objects once.
+    """
+    seen = set()
+    size = 0
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+    return size
+
+
+def index_quality(content: Dict) -> Dict[str, Any]:
+    """Index quality.json by file name, keeping each file's pages."""
+    return {name: result["pages"] for name, result in content["files"].items()}
+
+
+def index_results(content: list) -> Dict[str, Any]:
+    """Index results.json by file name."""
+    return {result["file_name"]: result for result in content}
+
+
+class ArtifactCache:
+    """
+    LRU cache of parsed flow artifacts, keyed on (bucket, key) and bounded by
+    their estimated memory (see deep_sizeof).
+
+    Every document of a transaction shares the same quality.json and
+    results.json, so they are downloaded and parsed once and then looked up by
+    file name. Entries older than ARTIFACT_CACHE_FRESHNESS are revalidated with
+    a conditional GET on their ETag, which costs a round trip but no transfer
+    or parsing when the object has not been rewritten. Concurrent misses for
+    the same object share a single download.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = ARTIFACT_CACHE_MAX_BYTES,
+        freshness: float = ARTIFACT_CACHE_FRESHNESS,
+    ):
+        self.max_bytes = max_bytes
+        self.freshness = freshness
+        self._entries: "OrderedDict[Tuple[str, str], Artifact]" = OrderedDict()
+        self._size = 0
+        self._inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    async def get_file(
+        self,
+        s3_client: AsyncS3Client,
+        bucket: str,
+        key: str,
+        file_name: str,
+        index: Callable[[Any], Dict[str, Any]],
+    ) -> Optional[Any]:
+        """Get the entry for one file of an artifact, or None if it has none."""
+        artifact = await self.get(s3_client, bucket, key, index)
+        return artifact.files.get(file_name)
+
+    async def get(
+        self,
+        s3_client: AsyncS3Client,
+        bucket: str,
+        key: str,
+        index: Callable[[Any], Dict[str, Any]],
+    ) -> Artifact:
+        """Get a parsed artifact, downloading it only if it changed."""
+        cache_key = (bucket, key)
+        artifact = self._entries.get(cache_key)
+        if artifact and time.monotonic() - artifact.checked_at < self.freshness:
+            self._entries.move_to_end(cache_key)
+            return artifact
+
+        # The download runs in its own task so a cancelled caller does not
+        # cancel it for the others waiting on it
+        task = self._inflight.get(cache_key)
+        if not task:
+            task = asyncio.create_task(
+                self._fetch(s3_client, bucket, key, index, artifact)
+            )
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda done: self._loaded(cache_key, done))
+        return await asyncio.shield(task)
+
+    def invalidate(self, bucket: str, key: str):
+        """Drop a cached artifact, e.g. after it was rewritten."""
+        artifact = self._entries.pop((bucket, key), None)
+        if artifact:
+            self._size -= artifact.size
+
+    async def _fetch(
+        self,
+        s3_client: AsyncS3Client,
+        bucket: str,
+        key: str,
+        index: Callable[[Any], Dict[str, Any]],
+        cached: Optional[Artifact],
+    ) -> Artifact:
+        cache_key = (bucket, key)
+        kwargs = {"Bucket": bucket, "Key": key}
+        if cached:
+            kwargs["IfNoneMatch"] = cached.etag
+
+        try:
+            response = await s3_client.get_object(**kwargs)
+        except ClientError as e:
+            if cached and e.response["Error"]["Code"] in ("304", "NotModified"):
+                artifact = cached._replace(checked_at=time.monotonic())
+                self._entries[cache_key] = artifact
+                self._entries.move_to_end(cache_key)
+                return artifact
+            raise
+
+        # Parsing and sizing take a while on large artifacts; keep them off the
+        # event loop
+        files, size = await asyncio.to_thread(_parse, response["Body"], index)
+        artifact = Artifact(
+            etag=response["ETag"],
+            files=files,
+            size=size,
+            checked_at=time.monotonic(),
+        )
+        self.invalidate(bucket, key)
+        if artifact.size <= self.max_bytes:
+            self._entries[cache_key] = artifact
+            self._size += artifact.size
+            self._evict()
+        return artifact
+
+    def _loaded(self, cache_key: Tuple[str, str], task: asyncio.Task):
+        del self._inflight[cache_key]
+        # Mark the exception as retrieved when every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def _evict(self):
+        while self._size > self.max_bytes:
+            _, artifact = self._entries.popitem(last=False)
+            self._size -= artifact.size
+            log.debug(f"Evicted artifact of {artifact.size} bytes")
+
+
+def _parse(
+    body: bytes, index: Callable[[Any], Dict[str, Any]]
+) -> Tuple[Dict[str, Any], int]:
+    files = index(orjson.loads(body))
+    return files, deep_sizeof(files)
+
+
+artifact_cache = ArtifactCache()
+
+
+async def split_flow_artifacts(
+    s3_client: AsyncS3Client,
+    bucket: str,
+    transaction_id: str,
+):
+    """
+    Write one small object per file next to quality.json and results.json.
+
+    Readers of a single document then download only its own section. Both
+    artifacts are parsed through the artifact cache, so callers that already
+    read them (like the quality aggregation) do not pay for parsing twice.
+    """
+    await asyncio.gather(
+        _split_artifact(
+            s3_client,
+            bucket=bucket,
+            key=QUALITY_KEY.format(transaction_id=transaction_id),
+            file_key=QUALITY_FILE_KEY,
+            transaction_id=transaction_id,
+            index=index_quality,
+        ),
+        _split_artifact(
+            s3_client,
+            bucket=bucket,
+            key=RESULTS_KEY.format(transaction_id=transaction_id),
+            file_key=RESULTS_FILE_KEY,
+            transaction_id=transaction_id,
+            index=index_results,
+        ),
+    )
+
+
+async def _split_artifact(
+    s3_client: AsyncS3Client,
+    bucket: str,
+    key: str,
+    file_key: str,
+    transaction_id: str,
+    index: Callable[[Any], Dict[str, Any]],
+):
+    artifact = await artifact_cache.get(s3_client, bucket, key, index)
+    await asyncio.gather(
+        *(
+            s3_client.put_object(
+                Bucket=bucket,
+                Key=file_key.format(transaction_id=transaction_id, file_name=file_name),
+                Body=encode_json(content),
+                ContentType="application/json",
+            )
+            for file_name, content in artifact.files.items()
+        )
+    )
+    log.info(f"Split {key} into {len(artifact.files)} per-file objects")
+
+
+async def get_quality_for_file(
+    s3_client: AsyncS3Client,
+    bucket: str,
+    transaction_id: str,
+    file_name: str,
+) -> Optional[Any]:
+    """Get the quality pages of one file of a transaction."""
+    return await _get_file_artifact(
+        s3_client,
+        bucket=bucket,
+        key=QUALITY_KEY.format(transaction_id=transaction_id),
+        file_key=QUALITY_FILE_KEY.format(
+            transaction_id=transaction_id, file_name=file_name
+        ),
+        file_name=file_name,
+        index=index_quality,
+    )
+
+
+async def get_results_for_file(
+    s3_client: AsyncS3Client,
+    bucket: str,
+    transaction_id: str,
+    file_name: str,
+) -> Optional[Any]:
+    """Get the processed result of one file of a transaction."""
+    return await _get_file_artifact(
+        s3_client,
+        bucket=bucket,
+        key=RESULTS_KEY.format(transaction_id=transaction_id),
+        file_key=RESULTS_FILE_KEY.format(
+            transaction_id=transaction_id, file_name=file_name
+        ),
+        file_name=file_name,
+        index=index_results,
+    )
+
+
+async def _get_file_artifact(
+    s3_client: AsyncS3Client,
+    bucket: str,
+    key: str,
+    file_key: str,
+    file_name: str,
+    index: Callable[[Any], Dict[str, Any]],
+) -> Optional[Any]:
+    """
+    Read the per-file object, falling back to the whole-transaction artifact
+    for transactions processed before artifacts were split.
+    """
+    try:
+        return await artifact_cache.get_file(
+            s3_client,
+            bucket=bucket,
+            key=file_key,
+            file_name=file_name,
+            index=lambda content: {file_name: content},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+
+    return await artifact_cache.get_file(
+        s3_client,
+        bucket=bucket,
+        key=key,
+        file_name=file_name,
+        index=index,
+    )
@@ -0,0 +1,203 @@
+import os
+import time
+import asyncio
+import asyncpg
+
+from logsim import CustomLogger
+from typing import Dict, List, NamedTuple, Optional
+
+from core.database import execute_query
+from core.notifications import notify, pg_listener
+from core.queries import register
+
+log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
+
+# Channel notified whenever templates, rules or their mappings change
+CATALOG_CHANNEL = "catalog_changed"
+# Safety net in case a notification is lost; 0 disables expiry
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", 300))
+
+LOAD_RULES_QUERY = register(
+    "catalog.load_rules",
+    """
+        SELECT id, name, description, rule_type, condition, action, created_at, updated_at
+        FROM rules
+        ORDER BY created_at DESC, id COLLATE "C" DESC
+    """,
+)
+LOAD_TEMPLATES_QUERY = register(
+    "catalog.load_templates",
+    """
+        SELECT t.id, t.name, t.description, t.field, t.prompt, t.created_at, t.updated_at, COALESCE(
+            (
+                SELECT json_agg(trm.rule_id)
+                FROM template_rule_mapping trm
+                WHERE trm.template_id = t.id
+            ),
+            '[]'::json
+        ) as rule_ids, COALESCE(
+            (
+                SELECT json_agg(
+                    json_build_object(
+                        'id', r.id,
+                        'name', r.name,
+                        'description', r.description,
+                        'rule_type', r.rule_type,
+                        'condition', r.condition,
+                        'action', r.action,
+                        'created_at', r.created_at,
+                        'updated_at', r.updated_at
+                    )
+                )
+                FROM template_rule_mapping trm
+                JOIN rules r ON trm.rule_id = r.id
+                WHERE trm.template_id = t.id
+            ),
+            '[]'::json
+        ) as rule_list
+        FROM templates t
+        ORDER BY t.created_at DESC, t.id COLLATE "C" DESC
+    """,
+)
+
+
+class Catalog(NamedTuple):
+    """Parsed templates and rules, newest first."""
+
+    rules: List[Dict]
+    templates: List[Dict]
+    templates_by_id: Dict[str, Dict]
+
+
+class CatalogCache:
+    """
+    In-process read-through cache of templates and rules.
+
+    JSON columns and aggregates are decoded by the pool's json/jsonb codecs, so
+    templates come back with field, rule_ids and rule_list as Python objects.
+
+    The whole catalog is loaded on the first read after an invalidation and
+    served from memory afterwards. Writers call notify_catalog_changed(), which
+    invalidates the cache in this worker right away and in every other worker
+    through Postgres LISTEN/NOTIFY.
+    """
+
+    def __init__(self):
+        self._catalog: Optional[Catalog] = None
+        self._loaded_at = 0.0
+        # Bumped on every invalidation so a load racing with it is discarded
+        self._version = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self, payload: Optional[str] = None):
+        """Drop the cached catalog."""
+        self._version += 1
+        self._catalog = None
+
+    async def get_rules(
+        self,
+        request_id: str = None,
+        connection: asyncpg.Connection = None,
+    ) -> List[Dict]:
+        """Get all rules, newest first."""
+        catalog = await self._get_catalog(request_id, connection)
+        return [dict(rule) for rule in catalog.rules]
+
+    async def get_templates(
+        self,
+        request_id: str = None,
+        connection: asyncpg.Connection = None,
+    ) -> List[Dict]:
+        """Get all templates with their rule_ids and rule_list, newest first."""
+        catalog = await self._get_catalog(request_id, connection)
+        return [dict(template) for template in catalog.templates]
+
+    async def get_templates_by_id(
+        self,
+        template_ids: List[str],
+        request_id: str = None,
+        connection: asyncpg.Connection = None,
+    ) -> Dict[str, Dict]:
+        """Get the templates matching the given ids, keyed by id."""
+        catalog = await self._get_catalog(request_id, connection)
+        return {
+            template_id: dict(catalog.templates_by_id[template_id])
+            for template_id in template_ids
+            if template_id in catalog.templates_by_id
+        }
+
+    async def _get_catalog(
+        self,
+        request_id: str = None,
+        connection: asyncpg.Connection = None,
+    ) -> Catalog:
+        catalog = self._fresh_catalog()
+        if catalog:
+            return catalog
+
+        async with self._lock:
+            catalog = self._fresh_catalog()
+            if catalog:
+                return catalog
+
+            version = self._version
+            catalog = await self._load(request_id, connection)
+            if version == self._version:
+                self._catalog = catalog
+                self._loaded_at = time.monotonic()
+            else:
+                # Invalidated while loading, serve it once but do not keep it
+                log.debug("Catalog changed while loading, not caching it")
+            return catalog
+
+    def _fresh_catalog(self) -> Optional[Catalog]:
+        if self._catalog is None:
+            return None
+        if CATALOG_CACHE_TTL and time.monotonic() - self._loaded_at > CATALOG_CACHE_TTL:
+            return None
+        return self._catalog
+
+    async def _load(
+        self,
+        request_id: str = None,
+        connection: asyncpg.Connection = None,
+    ) -> Catalog:
+        """Load and parse the whole catalog from the database."""
+        rules = await execute_query(
+            query=LOAD_RULES_QUERY,
+            params=(),
+            request_id=request_id,
+            connection=connection,
+        )
+        templates = await execute_query(
+            query=LOAD_TEMPLATES_QUERY,
+            params=(),
+            request_id=request_id,
+            connection=connection,
+        )
+
+        log.debug(f"Loaded {len(rules)} rules and {len(templates)} templates")
+        return Catalog(
+            rules=rules,
+            templates=templates,
+            templates_by_id={str(template["id"]): template for template in templates},
+        )
+
+
+async def notify_catalog_changed(
+    request_id: str = None,
+    connection: asyncpg.Connection = None,
+):
+    """
+    Invalidate the catalog cache in this worker and every other worker.
+    """
+    catalog_cache.invalidate()
+    await notify(
+        channel=CATALOG_CHANNEL,
+        request_id=request_id,
+        connection=connection,
+    )
+
+
+catalog_cache = CatalogCache()
+pg_listener.subscribe(CATALOG_CHANNEL, catalog_cache.invalidate)
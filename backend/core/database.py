@@ -1,19 +1,49 @@
 import os
 import time
+import asyncio
 
+import orjson
 import asyncpg
-from datetime import datetime
 
 from contextlib import asynccontextmanager
 from logsim import CustomLogger
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, List, Optional
 from migrations.migrations import run_database_migrations
+from core.queries import (
+    Query,
+    get_prepared,
+    prepare_registered_queries,
+    query_name,
+    query_sql,
+    record_query,
+)
 
 # Database pool instance
 db_pool: Optional[asyncpg.Pool] = None
+# Number of rows pulled from a server-side cursor per round trip
+STREAM_BATCH_SIZE = int(os.getenv("DB_STREAM_BATCH_SIZE", 500))
+
+# Pool sizing: the server's max_connections minus a reserve, split across workers
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 0))
+DB_RESERVED_CONNECTIONS = int(os.getenv("DB_RESERVED_CONNECTIONS", 10))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+# Admission control: seconds to wait for a connection and bound of the wait queue
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", 5))
+DB_MAX_WAITING = int(os.getenv("DB_MAX_WAITING", 100))
+
+# Number of callers currently waiting for a connection
+_waiting = 0
+# Number of callers turned away because the pool was saturated
+_rejected = 0
+
 log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
 
 
+class PoolExhaustedError(Exception):
+    """Raised when no database connection could be acquired in time."""
+
+
 async def init_db_pool(
     host: str,
     port: int,
@@ -25,16 +55,24 @@ async def init_db_pool(
     Initialize the database connection pool.
     """
     global db_pool
+    max_size = await _resolve_pool_size(
+        host=host,
+        port=port,
+        username=username,
+        password=password,
+        database=database,
+    )
     db_pool = await asyncpg.create_pool(
         host=host,
         port=port,
         user=username,
         password=password,
         database=database,
-        min_size=1,
-        max_size=10000,
+        min_size=min(DB_POOL_MIN_SIZE, max_size),
+        max_size=max_size,
+        init=_init_connection,
     )
-    log.info(f"Database pool to {host}:{port} initialized")
+    log.info(f"Database pool to {host}:{port} initialized with max size {max_size}")
 
     # Run database migrations
     try:
@@ -44,6 +82,65 @@ async def init_db_pool(
         log.error(f"Failed to run database migrations: {str(e)}")
         raise
 
+    # Recycle connections opened before the migrations so their prepared
+    # statements are rebuilt against the migrated schema
+    await db_pool.expire_connections()
+
+
+async def _resolve_pool_size(
+    host: str,
+    port: int,
+    username: str,
+    password: str,
+    database: str,
+) -> int:
+    """
+    Derive the pool size of this worker from the server's max_connections.
+    """
+    connection = await asyncpg.connect(
+        host=host,
+        port=port,
+        user=username,
+        password=password,
+        database=database,
+    )
+    try:
+        max_connections = int(await connection.fetchval("SHOW max_connections"))
+    finally:
+        await connection.close()
+
+    available = max_connections - DB_RESERVED_CONNECTIONS
+    max_size = max(1, available // max(1, WEB_CONCURRENCY))
+    if DB_POOL_MAX_SIZE:
+        max_size = min(max_size, DB_POOL_MAX_SIZE)
+
+    log.info(
+        f"Server allows {max_connections} connections, "
+        f"using {max_size} per worker across {WEB_CONCURRENCY} workers"
+    )
+    return max_size
+
+
+async def _init_connection(connection: asyncpg.Connection):
+    """
+    Set up a new pool connection.
+    """
+    # Decode json/jsonb inside the driver so rows arrive as Python objects.
+    # Codecs go first: statements prepared before them would keep text codecs.
+    for type_name in ("json", "jsonb"):
+        await connection.set_type_codec(
+            type_name,
+            encoder=_encode_json,
+            decoder=orjson.loads,
+            schema="pg_catalog",
+        )
+    await prepare_registered_queries(connection)
+
+
+def _encode_json(value) -> str:
+    """Encode a Python object for a json/jsonb parameter."""
+    return orjson.dumps(value).decode("utf-8")
+
 
 async def close_db_pool():
     """
@@ -60,16 +157,58 @@ async def close_db_pool():
 async def get_db_connection():
     """
     Get a database connection from the pool.
+
+    Raises PoolExhaustedError right away when too many callers are already
+    queued, or after DB_ACQUIRE_TIMEOUT seconds without a free connection.
     """
+    global _waiting, _rejected
     if not db_pool:
         raise Exception("Database pool not initialized")
 
-    async with db_pool.acquire() as connection:
+    if _waiting >= DB_MAX_WAITING:
+        _rejected += 1
+        raise PoolExhaustedError(f"{_waiting} requests already waiting")
+
+    _waiting += 1
+    try:
+        connection = await db_pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        _rejected += 1
+        raise PoolExhaustedError(
+            f"No database connection available after {DB_ACQUIRE_TIMEOUT}s"
+        )
+    finally:
+        _waiting -= 1
+
+    try:
         yield connection
+    finally:
+        await db_pool.release(connection)
+
+
+def get_pool_stats() -> Dict:
+    """
+    Get in-use, idle and waiting connection counts of the pool.
+    """
+    if not db_pool:
+        return {}
+
+    size = db_pool.get_size()
+    idle = db_pool.get_idle_size()
+    return {
+        "size": size,
+        "min_size": db_pool.get_min_size(),
+        "max_size": db_pool.get_max_size(),
+        "in_use": size - idle,
+        "idle": idle,
+        "waiting": _waiting,
+        "max_waiting": DB_MAX_WAITING,
+        "rejected": _rejected,
+    }
 
 
 async def execute_query(
-    query: str,
+    query: Query | str,
     params: tuple,
     request_id: str = None,
     connection: asyncpg.Connection = None,
@@ -97,30 +236,31 @@ async def execute_query(
 
 async def _execute_with_connection(
     connection: asyncpg.Connection,
-    query: str,
+    query: Query | str,
     params: tuple,
     request_id: str = None,
 ) -> List[Dict]:
     """Execute query with a specific connection."""
+    name = query_name(query)
     log.debug(
-        msg=f"Executing query: {query[:100]}...",
+        msg=f"Executing query {name}: {query_sql(query)[:100]}...",
         extra={"request_id": request_id} if request_id else {},
     )
 
     start = time.time()
-    result = await connection.fetch(query, *params)
-
-    # Convert rows to dictionaries and handle datetime objects
-    processed_result = []
-    for row in result:
-        row_dict = dict(row)
-        # Convert datetime objects to ISO format strings
-        for key, value in row_dict.items():
-            if isinstance(value, datetime):
-                row_dict[key] = value.isoformat()
-        processed_result.append(row_dict)
+    try:
+        statement = get_prepared(connection, query)
+        if statement:
+            result = await statement.fetch(*params)
+        else:
+            result = await connection.fetch(query_sql(query), *params)
+    except Exception:
+        record_query(name, (time.time() - start) * 1000, failed=True)
+        raise
+    processed_result = [dict(row) for row in result]
 
     elapsed = time.time() - start
+    record_query(name, elapsed * 1000)
 
     log.debug(
         msg=f"Query returned {len(processed_result)} rows in {elapsed:.2f}s",
@@ -128,3 +268,140 @@ async def _execute_with_connection(
     )
 
     return processed_result
+
+
+async def execute_many(
+    query: Query | str,
+    params_list: List[tuple],
+    request_id: str = None,
+    connection: asyncpg.Connection = None,
+):
+    """
+    Execute a statement once per parameter tuple in a single batch.
+    """
+    # Use provided connection or get one from pool
+    if connection:
+        await _execute_many_with_connection(
+            connection=connection,
+            query=query,
+            params_list=params_list,
+            request_id=request_id,
+        )
+    else:
+        async with get_db_connection() as conn:
+            await _execute_many_with_connection(
+                connection=conn,
+                query=query,
+                params_list=params_list,
+                request_id=request_id,
+            )
+
+
+async def _execute_many_with_connection(
+    connection: asyncpg.Connection,
+    query: Query | str,
+    params_list: List[tuple],
+    request_id: str = None,
+):
+    """Execute a batched statement with a specific connection."""
+    name = query_name(query)
+    log.debug(
+        msg=f"Executing query {name} for {len(params_list)} rows: {query_sql(query)[:100]}...",
+        extra={"request_id": request_id} if request_id else {},
+    )
+
+    start = time.time()
+    try:
+        statement = get_prepared(connection, query)
+        if statement:
+            await statement.executemany(params_list)
+        else:
+            await connection.executemany(query_sql(query), params_list)
+    except Exception:
+        record_query(name, (time.time() - start) * 1000, failed=True)
+        raise
+
+    elapsed = time.time() - start
+    record_query(name, elapsed * 1000)
+
+    log.debug(
+        msg=f"Query wrote {len(params_list)} rows in {elapsed:.2f}s",
+        extra={"request_id": request_id} if request_id else {},
+    )
+
+
+async def stream_query(
+    query: Query | str,
+    params: tuple,
+    request_id: str = None,
+    connection: asyncpg.Connection = None,
+    batch_size: int = STREAM_BATCH_SIZE,
+) -> AsyncIterator[List[Dict]]:
+    """
+    Execute a query through a server-side cursor and yield the rows in batches,
+    so the full result set never has to be held in memory.
+    """
+    if connection:
+        async for batch in _stream_with_connection(
+            connection=connection,
+            query=query,
+            params=params,
+            request_id=request_id,
+            batch_size=batch_size,
+        ):
+            yield batch
+    else:
+        async with get_db_connection() as conn:
+            async for batch in _stream_with_connection(
+                connection=conn,
+                query=query,
+                params=params,
+                request_id=request_id,
+                batch_size=batch_size,
+            ):
+                yield batch
+
+
+async def _stream_with_connection(
+    connection: asyncpg.Connection,
+    query: Query | str,
+    params: tuple,
+    request_id: str = None,
+    batch_size: int = STREAM_BATCH_SIZE,
+) -> AsyncIterator[List[Dict]]:
+    """Stream query results with a specific connection."""
+    name = query_name(query)
+    log.debug(
+        msg=f"Streaming query {name}: {query_sql(query)[:100]}...",
+        extra={"request_id": request_id} if request_id else {},
+    )
+
+    start = time.time()
+    row_count = 0
+
+    # Server-side cursors only live inside a transaction
+    try:
+        async with connection.transaction():
+            statement = get_prepared(connection, query)
+            if statement:
+                cursor = await statement.cursor(*params)
+            else:
+                cursor = await connection.cursor(query_sql(query), *params)
+            while True:
+                rows = await cursor.fetch(batch_size)
+                if not rows:
+                    break
+                row_count += len(rows)
+                yield [dict(row) for row in rows]
+    except Exception:
+        record_query(name, (time.time() - start) * 1000, failed=True)
+        raise
+
+    elapsed = time.time() - start
+    record_query(name, elapsed * 1000)
+
+    log.debug(
+        msg=f"Query streamed {row_count} rows in {elapsed:.2f}s",
+        extra={"request_id": request_id} if request_id else {},
+    )
+
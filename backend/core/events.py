@@ -0,0 +1,170 @@
+import os
+import asyncio
+import asyncpg
+import orjson
+
+from collections import deque
+from logsim import CustomLogger
+from typing import AsyncIterator, Deque, Dict, List, Optional, Set, Tuple
+
+from core.database import execute_query
+from core.notifications import pg_listener
+from core.queries import register
+
+log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
+
+# Channel carrying document status and quality transitions to every worker
+DOCUMENT_EVENTS_CHANNEL = "document_events"
+# Events kept in memory so reconnecting clients can resume from Last-Event-ID
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", 1000))
+# Events queued for one slow client before it is disconnected
+EVENT_CLIENT_QUEUE_SIZE = int(os.getenv("EVENT_CLIENT_QUEUE_SIZE", 100))
+# Seconds between keep-alive comments on idle streams
+EVENT_KEEPALIVE_INTERVAL = float(os.getenv("EVENT_KEEPALIVE_INTERVAL", 15))
+# NOTIFY payloads are limited to 8000 bytes; events are split to stay below
+EVENT_PAYLOAD_LIMIT = 7000
+
+# Queries
+PUBLISH_DOCUMENT_EVENTS_QUERY = register(
+    "events.publish_document_events",
+    """
+        SELECT pg_notify(
+            $1,
+            json_build_object('id', nextval('document_event_seq'), 'events', $2::json)::text
+        )
+    """,
+)
+
+# Sent instead of a replay when the requested events are no longer buffered
+RESET_EVENT = b"event: reset\ndata: {}\n\n"
+KEEPALIVE_COMMENT = b": keep-alive\n\n"
+
+
+class EventBroadcaster:
+    """
+    Fan document events out to every Server-Sent Events client of the worker.
+
+    Events are published with NOTIFY, so each worker receives the events of
+    all workers, in the same order, through pg_listener. Every notification is
+    encoded once as an SSE message and shared by all subscribers; an idle
+    client only costs a queue and a suspended generator.
+
+    Event ids come from a Postgres sequence, so they mean the same thing on
+    every worker. The last EVENT_BUFFER_SIZE events are kept in a ring buffer:
+    a client reconnecting with Last-Event-ID gets every event it missed, or a
+    reset event asking it to reload when they are no longer buffered.
+    """
+
+    def __init__(self, buffer_size: int = EVENT_BUFFER_SIZE):
+        self._buffer: Deque[Tuple[int, bytes]] = deque(maxlen=buffer_size)
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def dispatch(self, payload: Optional[str]):
+        """pg_listener callback."""
+        if payload is None:
+            # Events sent while the listener was down are lost
+            self._buffer.clear()
+            self._broadcast(RESET_EVENT)
+            return
+
+        notification = orjson.loads(payload)
+        event_id = notification["id"]
+        message = (
+            f"id: {event_id}\nevent: documents\ndata: ".encode("utf-8")
+            + orjson.dumps(notification["events"])
+            + b"\n\n"
+        )
+        self._buffer.append((event_id, message))
+        self._broadcast(message, event_id)
+
+    def _broadcast(self, message: bytes, event_id: Optional[int] = None):
+        for queue in list(self._subscribers):
+            if queue.qsize() >= EVENT_CLIENT_QUEUE_SIZE:
+                # Too slow to keep up; it resumes from Last-Event-ID on reconnect
+                self._subscribers.discard(queue)
+                queue.put_nowait(None)
+            else:
+                queue.put_nowait((event_id, message))
+
+    def _replay(self, last_event_id: str) -> List[Tuple[Optional[int], bytes]]:
+        """Get the buffered (id, message) pairs after last_event_id."""
+        ids = [str(event_id) for event_id, _ in self._buffer]
+        if last_event_id not in ids:
+            return [(None, RESET_EVENT)]
+        start = ids.index(last_event_id) + 1
+        return list(self._buffer)[start:]
+
+    async def stream(self, last_event_id: Optional[str] = None) -> AsyncIterator[bytes]:
+        """Yield SSE messages for one client until it disconnects."""
+        queue: asyncio.Queue = asyncio.Queue()
+        # Subscribe before replaying so no event falls in between. Events
+        # published in between are both replayed and queued, so queued events
+        # up to the last replayed one are skipped
+        self._subscribers.add(queue)
+        replayed = None
+        try:
+            yield b"retry: 3000\n\n"
+            if last_event_id:
+                for event_id, message in self._replay(last_event_id):
+                    if event_id is not None:
+                        replayed = event_id
+                    yield message
+
+            while True:
+                try:
+                    item = await asyncio.wait_for(
+                        queue.get(), timeout=EVENT_KEEPALIVE_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE_COMMENT
+                    continue
+                if item is None:
+                    return
+                event_id, message = item
+                if replayed is not None and event_id is not None and event_id <= replayed:
+                    continue
+                yield message
+        finally:
+            self._subscribers.discard(queue)
+
+
+async def publish_document_events(
+    events: List[Dict],
+    request_id: str = None,
+    connection: asyncpg.Connection = None,
+):
+    """
+    Publish document events to the SSE clients of every worker.
+    """
+    for chunk in _chunk_events(events):
+        await execute_query(
+            query=PUBLISH_DOCUMENT_EVENTS_QUERY,
+            params=(DOCUMENT_EVENTS_CHANNEL, chunk),
+            request_id=request_id,
+            connection=connection,
+        )
+
+
+def _chunk_events(events: List[Dict]) -> List[List[Dict]]:
+    """Split events into lists whose JSON fits in one NOTIFY payload."""
+    chunks: List[List[Dict]] = []
+    chunk: List[Dict] = []
+    size = 0
+    for event in events:
+        event_size = len(orjson.dumps(event, default=str)) + 1
+        if chunk and size + event_size > EVENT_PAYLOAD_LIMIT:
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append(event)
+        size += event_size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+event_broadcaster = EventBroadcaster()
+pg_listener.subscribe(DOCUMENT_EVENTS_CHANNEL, event_broadcaster.dispatch)
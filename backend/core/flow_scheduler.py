@@ -0,0 +1,449 @@
+import os
+import json
+import time
+import uuid
+import socket
+import heapq
+import random
+import asyncio
+import asyncpg
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from logsim import CustomLogger
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from core.database import execute_query
+from core.notifications import notify, pg_listener
+from core.pinazu_client import PinazuError, get_pinazu_client
+from core.queries import register
+
+log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
+
+# Delay before the first poll of a run, and after every status change
+FLOW_POLL_INTERVAL = float(os.getenv("TIME_TO_MONITOR_FLOW", 5))
+# Ceiling of the backoff while a run keeps the same status
+FLOW_POLL_MAX_INTERVAL = float(os.getenv("FLOW_POLL_MAX_INTERVAL", 60))
+# Status polls in flight at once across every run of this worker
+FLOW_POLL_CONCURRENCY = int(os.getenv("FLOW_POLL_CONCURRENCY", 16))
+# Base URL the flow service calls back on status transitions, and the shared
+# secret it sends with them. Callbacks are only used when both are set: runs
+# are then only polled once no callback arrived for FLOW_CALLBACK_DEADLINE
+# seconds
+FLOW_CALLBACK_URL = os.getenv("FLOW_CALLBACK_URL")
+FLOW_CALLBACK_TOKEN = os.getenv("FLOW_CALLBACK_TOKEN")
+FLOW_CALLBACKS_ENABLED = bool(FLOW_CALLBACK_URL and FLOW_CALLBACK_TOKEN)
+FLOW_CALLBACK_DEADLINE = float(os.getenv("FLOW_CALLBACK_DEADLINE", 120))
+
+# Channel used to tell every worker about statuses received by callback
+FLOW_STATUS_CHANNEL = "flow_run_status"
+
+# Seconds a worker owns the runs it claimed; renewed every third of it
+FLOW_LEASE_DURATION = float(os.getenv("FLOW_LEASE_DURATION", 60))
+# Upper bound of runs claimed by one worker per lease cycle
+FLOW_LEASE_BATCH = int(os.getenv("FLOW_LEASE_BATCH", 100))
+
+# Flow run statuses acted upon, compared in upper case. Documents take the
+# status of their flow run, and start as PENDING_STATUS until it is executed
+SUCCESS_STATUS = "SUCCESS"
+FAILED_STATUS = "FAILED"
+TERMINAL_STATUSES = {FAILED_STATUS, SUCCESS_STATUS}
+PENDING_STATUS = "pending"
+
+# Queries
+CREATE_FLOW_RUN_QUERY = register(
+    "flow_scheduler.create_flow_run",
+    """
+        INSERT INTO flow_runs (flow_run_id, flow_id, transaction_id, status, next_poll_at, lease_owner, lease_expires_at)
+        VALUES ($1, $2, $3, $4, NOW() + make_interval(secs => $5), $6, NOW() + make_interval(secs => $7))
+        ON CONFLICT (flow_run_id) DO NOTHING
+    """,
+)
+UPDATE_FLOW_RUN_STATUS_QUERY = register(
+    "flow_scheduler.update_flow_run_status",
+    """
+        UPDATE flow_runs
+        SET status = $2, next_poll_at = NOW() + make_interval(secs => $3), updated_at = NOW()
+        WHERE flow_run_id = $1 AND completed_at IS NULL
+    """,
+)
+COMPLETE_FLOW_RUN_QUERY = register(
+    "flow_scheduler.complete_flow_run",
+    """
+        UPDATE flow_runs
+        SET status = $2, completed_at = NOW(), lease_owner = NULL, lease_expires_at = NULL, updated_at = NOW()
+        WHERE flow_run_id = $1 AND completed_at IS NULL
+    """,
+)
+CLAIM_FLOW_RUN_COMPLETION_QUERY = register(
+    "flow_scheduler.claim_flow_run_completion",
+    """
+        INSERT INTO flow_runs (flow_run_id, flow_id, transaction_id, status, completed_at)
+        VALUES ($1, $2, $3, $4, NOW())
+        ON CONFLICT (flow_run_id) DO UPDATE
+        SET status = EXCLUDED.status, completed_at = NOW(), lease_owner = NULL, lease_expires_at = NULL, updated_at = NOW()
+        WHERE flow_runs.completed_at IS NULL
+        RETURNING flow_run_id
+    """,
+)
+RENEW_FLOW_RUN_LEASES_QUERY = register(
+    "flow_scheduler.renew_flow_run_leases",
+    """
+        UPDATE flow_runs
+        SET lease_expires_at = NOW() + make_interval(secs => $2)
+        WHERE lease_owner = $1 AND completed_at IS NULL
+        RETURNING flow_run_id
+    """,
+)
+CLAIM_FLOW_RUNS_QUERY = register(
+    "flow_scheduler.claim_flow_runs",
+    """
+        UPDATE flow_runs
+        SET lease_owner = $1, lease_expires_at = NOW() + make_interval(secs => $2)
+        WHERE flow_run_id IN (
+            SELECT flow_run_id
+            FROM flow_runs
+            WHERE completed_at IS NULL
+              AND (lease_expires_at IS NULL OR lease_expires_at < NOW())
+            ORDER BY next_poll_at
+            LIMIT $3
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING flow_run_id, flow_id, transaction_id, status, next_poll_at
+    """,
+)
+RELEASE_FLOW_RUN_LEASES_QUERY = register(
+    "flow_scheduler.release_flow_run_leases",
+    """
+        UPDATE flow_runs
+        SET lease_owner = NULL, lease_expires_at = NULL
+        WHERE lease_owner = $1 AND completed_at IS NULL
+    """,
+)
+
+
+@dataclass
+class FlowRun:
+    """A flow run tracked until it reaches a terminal status."""
+
+    flow_id: str
+    flow_run_id: str
+    transaction_id: str
+    request_id: Optional[str]
+    status: Optional[str] = None
+    interval: float = FLOW_POLL_INTERVAL
+    next_poll_at: float = 0.0
+
+
+# Called with a run and its freshly polled status
+StatusHandler = Callable[[FlowRun, str], Awaitable[None]]
+
+
+class FlowScheduler:
+    """Poll the active flow runs leased to this worker from one loop."""
+
+    def __init__(self, concurrency: int = FLOW_POLL_CONCURRENCY):
+        self._runs: Dict[str, FlowRun] = {}
+        self._heap: List[Tuple[float, str]] = []
+        # Runs whose poll is in flight; they are rescheduled when it finishes
+        self._polling: Set[str] = set()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._handler: Optional[StatusHandler] = None
+        self._task: Optional[asyncio.Task] = None
+        self._poll_tasks: Set[asyncio.Task] = set()
+        self._lease_task: Optional[asyncio.Task] = None
+        # Identifies this process's leases in flow_runs. Hostname and pid repeat
+        # when a container restarts, so a fresh uuid keeps a crashed process's
+        # leases from being renewed, and never claimed, by its successor
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex}"
+
+    @property
+    def active_runs(self) -> int:
+        return len(self._runs)
+
+    def track(
+        self,
+        flow_id: str,
+        flow_run_id: str,
+        transaction_id: str,
+        request_id: Optional[str],
+        status: Optional[str] = None,
+        delay: Optional[float] = None,
+    ):
+        """Start polling a flow run; runs already tracked are left as they are."""
+        if flow_run_id in self._runs:
+            return
+        run = FlowRun(
+            flow_id=flow_id,
+            flow_run_id=flow_run_id,
+            transaction_id=transaction_id,
+            request_id=request_id,
+            status=status,
+        )
+        self._runs[flow_run_id] = run
+        self._schedule(run, self._first_poll_delay() if delay is None else delay)
+        log.info(f"Tracking flow run {flow_run_id}")
+
+    async def add_run(
+        self,
+        flow_id: str,
+        flow_run_id: str,
+        transaction_id: str,
+        request_id: str,
+        status: Optional[str] = None,
+        connection: asyncpg.Connection = None,
+    ):
+        """Persist a new flow run, leased to this worker, and start polling it."""
+        await execute_query(
+            query=CREATE_FLOW_RUN_QUERY,
+            params=(
+                flow_run_id,
+                flow_id,
+                transaction_id,
+                status,
+                self._first_poll_delay(),
+                self.owner,
+                FLOW_LEASE_DURATION,
+            ),
+            request_id=request_id,
+            connection=connection,
+        )
+        self.track(flow_id, flow_run_id, transaction_id, request_id, status)
+
+    def record_status(self, flow_run_id: str, status: str):
+        """
+        Take a status received by callback into account: terminal runs stop
+        being polled, the others are only polled again after the deadline.
+        """
+        run = self._runs.get(flow_run_id)
+        if not run:
+            return
+        if status and status.upper() in TERMINAL_STATUSES:
+            log.info(f"Flow {flow_run_id} completed with status: {status}")
+            self.untrack(flow_run_id)
+            return
+        run.status = status
+        run.interval = FLOW_POLL_INTERVAL
+        if flow_run_id not in self._polling:
+            self._schedule(run, self._first_poll_delay())
+
+    def _on_notification(self, payload: Optional[str]):
+        """pg_listener callback for statuses received by other workers."""
+        if payload:
+            message = json.loads(payload)
+            self.record_status(message["flow_run_id"], message["status"])
+
+    def _first_poll_delay(self) -> float:
+        return FLOW_CALLBACK_DEADLINE if FLOW_CALLBACKS_ENABLED else FLOW_POLL_INTERVAL
+
+    def untrack(self, flow_run_id: str):
+        """Stop polling a flow run."""
+        # Heap entries of removed runs are skipped when they come up
+        self._runs.pop(flow_run_id, None)
+
+    async def start(self, handler: StatusHandler):
+        """Start polling in the background, passing every status to handler."""
+        self._handler = handler
+        self._task = asyncio.create_task(self._run())
+        self._lease_task = asyncio.create_task(self._run_leases())
+
+    async def stop(self):
+        """Stop polling and hand the active runs over to other workers."""
+        tasks = [
+            task for task in [self._task, self._lease_task, *self._poll_tasks] if task
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._lease_task = None
+
+        try:
+            await execute_query(
+                query=RELEASE_FLOW_RUN_LEASES_QUERY,
+                params=(self.owner,),
+            )
+        except Exception as e:
+            log.error(f"Failed to release flow run leases: {str(e)}")
+        log.info(f"Flow scheduler stopped with {self.active_runs} active runs")
+        self._runs.clear()
+
+    def _schedule(self, run: FlowRun, delay: float):
+        run.next_poll_at = time.monotonic() + delay
+        heapq.heappush(self._heap, (run.next_poll_at, run.flow_run_id))
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+
+            while self._heap and self._heap[0][0] <= now:
+                due, flow_run_id = heapq.heappop(self._heap)
+                run = self._runs.get(flow_run_id)
+                # Skip entries of removed runs and ones superseded by a reschedule
+                if not run or run.next_poll_at != due or flow_run_id in self._polling:
+                    continue
+                self._polling.add(flow_run_id)
+                task = asyncio.create_task(self._poll(run))
+                self._poll_tasks.add(task)
+                task.add_done_callback(self._poll_tasks.discard)
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, run: FlowRun):
+        try:
+            async with self._semaphore:
+                status_data = await get_pinazu_client().get_flow_status(
+                    run.flow_run_id
+                )
+            status = status_data.get("status")
+            log.debug(f"Flow {run.flow_run_id} status: {status}")
+
+            await self._handler(run, status)
+
+            if status and status.upper() in TERMINAL_STATUSES:
+                log.info(f"Flow {run.flow_run_id} completed with status: {status}")
+                self.untrack(run.flow_run_id)
+                await save_flow_run_status(run.flow_run_id, status, run.request_id)
+                return
+
+            if status == run.status:
+                run.interval = min(run.interval * 2, FLOW_POLL_MAX_INTERVAL)
+            else:
+                run.status = status
+                run.interval = FLOW_POLL_INTERVAL
+                await save_flow_run_status(
+                    run.flow_run_id, status, run.request_id, delay=run.interval
+                )
+        except PinazuError as e:
+            log.error(f"Request error monitoring flow {run.flow_run_id}: {str(e)}")
+            run.interval = min(run.interval * 2, FLOW_POLL_MAX_INTERVAL)
+        except Exception as e:
+            log.error(f"Error monitoring flow {run.flow_run_id}: {str(e)}")
+        finally:
+            self._polling.discard(run.flow_run_id)
+
+        if run.flow_run_id in self._runs:
+            # Jitter spreads runs started together over the interval
+            self._schedule(run, random.uniform(run.interval / 2, run.interval))
+
+    async def _run_leases(self):
+        """Renew this worker's leases and claim runs nobody is polling."""
+        while True:
+            try:
+                await self._renew_leases()
+                await self._claim_runs()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Failed to refresh flow run leases: {str(e)}")
+            await asyncio.sleep(FLOW_LEASE_DURATION / 3)
+
+    async def _renew_leases(self):
+        # Runs added while renewing may not be visible to the query yet
+        flow_run_ids = list(self._runs)
+        rows = await execute_query(
+            query=RENEW_FLOW_RUN_LEASES_QUERY,
+            params=(self.owner, FLOW_LEASE_DURATION),
+        )
+        leased = {row["flow_run_id"] for row in rows}
+        # Runs completed elsewhere or taken over after our lease expired
+        for flow_run_id in [key for key in flow_run_ids if key not in leased]:
+            log.warning(f"Lost the lease of flow run {flow_run_id}")
+            self.untrack(flow_run_id)
+
+    async def _claim_runs(self):
+        rows = await execute_query(
+            query=CLAIM_FLOW_RUNS_QUERY,
+            params=(self.owner, FLOW_LEASE_DURATION, FLOW_LEASE_BATCH),
+        )
+        now = datetime.now(timezone.utc)
+        for row in rows:
+            self.track(
+                flow_id=row["flow_id"],
+                flow_run_id=row["flow_run_id"],
+                transaction_id=row["transaction_id"],
+                request_id=None,
+                status=row["status"],
+                delay=max((row["next_poll_at"] - now).total_seconds(), 0),
+            )
+        if rows:
+            log.info(f"Resumed {len(rows)} flow runs")
+
+
+async def save_flow_run_status(
+    flow_run_id: str,
+    status: str,
+    request_id: str = None,
+    connection: asyncpg.Connection = None,
+    delay: float = FLOW_POLL_INTERVAL,
+):
+    """
+    Persist the latest status of a flow run; terminal runs are completed and
+    never resumed.
+    """
+    if status and status.upper() in TERMINAL_STATUSES:
+        query, params = COMPLETE_FLOW_RUN_QUERY, (flow_run_id, status)
+    else:
+        query, params = UPDATE_FLOW_RUN_STATUS_QUERY, (flow_run_id, status, delay)
+    await execute_query(
+        query=query,
+        params=params,
+        request_id=request_id,
+        connection=connection,
+    )
+
+
+async def complete_flow_run(
+    run: FlowRun,
+    status: str,
+    request_id: str = None,
+    connection: asyncpg.Connection = None,
+) -> bool:
+    """
+    Complete a flow run with its terminal status; only the caller that
+    completed it gets True.
+    """
+    rows = await execute_query(
+        query=CLAIM_FLOW_RUN_COMPLETION_QUERY,
+        params=(run.flow_run_id, run.flow_id, run.transaction_id, status),
+        request_id=request_id,
+        connection=connection,
+    )
+    return bool(rows)
+
+
+async def notify_flow_status(
+    flow_run_id: str,
+    status: str,
+    request_id: str = None,
+    connection: asyncpg.Connection = None,
+):
+    """
+    Persist a status received by callback and record it in this worker and
+    every other one, whichever of them is tracking the run.
+    """
+    flow_scheduler.record_status(flow_run_id, status)
+    await save_flow_run_status(
+        flow_run_id,
+        status,
+        request_id=request_id,
+        connection=connection,
+        delay=flow_scheduler._first_poll_delay(),
+    )
+    await notify(
+        channel=FLOW_STATUS_CHANNEL,
+        payload=json.dumps({"flow_run_id": flow_run_id, "status": status}),
+        request_id=request_id,
+        connection=connection,
+    )
+
+
+flow_scheduler = FlowScheduler()
+pg_listener.subscribe(FLOW_STATUS_CHANNEL, flow_scheduler._on_notification)
@@ -0,0 +1,545 @@
+import os
+import time
+import uuid
+import socket
+import random
+import asyncio
+import asyncpg
+
+from dataclasses import dataclass
+from logsim import CustomLogger
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type
+
+from core.catalog_cache import catalog_cache
+from core.database import execute_query
+from core.events import publish_document_events
+from core.flow_scheduler import FAILED_STATUS
+from core.pinazu_client import CircuitOpenError, get_pinazu_client
+from core.queries import QueryStats, register
+from core.responses import encode_json
+from core.s3_client import get_s3_client
+
+log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
+
+S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+
+# Jobs processed at once by this worker
+INGESTION_CONCURRENCY = int(os.getenv("INGESTION_CONCURRENCY", 4))
+# Upper bound of jobs queued or running in this worker; the rest wait in the
+# ingestion_jobs table for whichever worker has room
+INGESTION_QUEUE_SIZE = int(os.getenv("INGESTION_QUEUE_SIZE", 100))
+# Seconds one attempt of a stage may take
+INGESTION_STAGE_TIMEOUT = float(os.getenv("INGESTION_STAGE_TIMEOUT", 60))
+# Attempts of a failing stage, with full-jitter exponential backoff
+INGESTION_STAGE_ATTEMPTS = int(os.getenv("INGESTION_STAGE_ATTEMPTS", 3))
+INGESTION_RETRY_BACKOFF = float(os.getenv("INGESTION_RETRY_BACKOFF", 1))
+# Claims of the same job (worker crashes included) before it is failed
+INGESTION_MAX_CLAIMS = int(os.getenv("INGESTION_MAX_CLAIMS", 3))
+# Seconds a worker owns the jobs it claimed; renewed every third of it
+INGESTION_LEASE_DURATION = float(os.getenv("INGESTION_LEASE_DURATION", 60))
+# Seconds given to queued and running jobs to finish on shutdown
+INGESTION_DRAIN_TIMEOUT = float(os.getenv("INGESTION_DRAIN_TIMEOUT", 30))
+
+# Queries
+CREATE_INGESTION_JOB_QUERY = register(
+    "ingestion.create_ingestion_job",
+    """
+        INSERT INTO ingestion_jobs (transaction_id, template_ids, attempts, lease_owner, lease_expires_at)
+        VALUES ($1, $2, $3, $4, NOW() + make_interval(secs => $5))
+    """,
+)
+SET_INGESTION_FLOW_QUERY = register(
+    "ingestion.set_ingestion_flow",
+    """
+        WITH job AS (
+            UPDATE ingestion_jobs
+            SET flow_id = $2, updated_at = NOW()
+            WHERE transaction_id = $1
+        )
+        UPDATE documents
+        SET flow_id = $2, updated_at = NOW()
+        WHERE transaction_id = $1
+    """,
+)
+START_INGESTION_EXECUTION_QUERY = register(
+    "ingestion.start_ingestion_execution",
+    """
+        UPDATE ingestion_jobs
+        SET execute_started_at = NOW(), updated_at = NOW()
+        WHERE transaction_id = $1
+    """,
+)
+SET_INGESTION_FLOW_RUN_QUERY = register(
+    "ingestion.set_ingestion_flow_run",
+    """
+        UPDATE ingestion_jobs
+        SET executed_at = NOW(), flow_run_id = $2, flow_status = $3, updated_at = NOW()
+        WHERE transaction_id = $1
+    """,
+)
+COMPLETE_INGESTION_JOB_QUERY = register(
+    "ingestion.complete_ingestion_job",
+    """
+        UPDATE ingestion_jobs
+        SET completed_at = NOW(), lease_owner = NULL, lease_expires_at = NULL, updated_at = NOW()
+        WHERE transaction_id = $1 AND completed_at IS NULL
+    """,
+)
+FAIL_INGESTION_JOB_QUERY = register(
+    "ingestion.fail_ingestion_job",
+    """
+        WITH job AS (
+            UPDATE ingestion_jobs
+            SET error = $2, completed_at = NOW(), lease_owner = NULL, lease_expires_at = NULL, updated_at = NOW()
+            WHERE transaction_id = $1 AND completed_at IS NULL
+        )
+        UPDATE documents
+        SET status = $3, updated_at = NOW()
+        WHERE transaction_id = $1 AND status IS DISTINCT FROM $3
+        RETURNING id, flow_id, status
+    """,
+)
+RENEW_INGESTION_JOB_LEASES_QUERY = register(
+    "ingestion.renew_ingestion_job_leases",
+    """
+        UPDATE ingestion_jobs
+        SET lease_expires_at = NOW() + make_interval(secs => $2)
+        WHERE lease_owner = $1 AND completed_at IS NULL
+        RETURNING transaction_id
+    """,
+)
+CLAIM_INGESTION_JOBS_QUERY = register(
+    "ingestion.claim_ingestion_jobs",
+    """
+        UPDATE ingestion_jobs
+        SET lease_owner = $1, lease_expires_at = NOW() + make_interval(secs => $2), attempts = attempts + 1
+        WHERE transaction_id IN (
+            SELECT transaction_id
+            FROM ingestion_jobs
+            WHERE completed_at IS NULL
+              AND (lease_owner IS NULL OR lease_expires_at < NOW())
+            ORDER BY created_at
+            LIMIT $3
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING transaction_id, template_ids, flow_id, attempts,
+                  execute_started_at IS NOT NULL AS execute_started,
+                  executed_at IS NOT NULL AS executed,
+                  flow_run_id, flow_status
+    """,
+)
+RELEASE_INGESTION_JOB_QUERY = register(
+    "ingestion.release_ingestion_job",
+    """
+        UPDATE ingestion_jobs
+        SET lease_owner = NULL, lease_expires_at = NULL
+        WHERE transaction_id = $1 AND lease_owner = $2
+    """,
+)
+RELEASE_INGESTION_JOB_LEASES_QUERY = register(
+    "ingestion.release_ingestion_job_leases",
+    """
+        UPDATE ingestion_jobs
+        SET lease_owner = NULL, lease_expires_at = NULL
+        WHERE lease_owner = $1 AND completed_at IS NULL
+    """,
+)
+
+
+class IngestionError(Exception):
+    """Raised when a job can not succeed, however often it is retried."""
+
+
+class LeaseLostError(Exception):
+    """Raised when another worker took a job over."""
+
+
+@dataclass
+class IngestionJob:
+    """An upload whose flow still has to be created and executed."""
+
+    transaction_id: str
+    template_ids: List[str]
+    request_id: Optional[str]
+    flow_id: Optional[str] = None
+    # Set before the flow service is asked to execute the flow
+    execute_started: bool = False
+    # Set once it answered with the run
+    executed: bool = False
+    flow_run_id: Optional[str] = None
+    flow_status: Optional[str] = None
+    # Whether this worker holds the lease of the job
+    leased: bool = True
+    lost: bool = False
+
+
+# Asks the flow service to execute a flow, returning the run it started
+FlowExecutor = Callable[[str, str], Awaitable[Dict[str, Any]]]
+# Records the status of an executed flow and starts monitoring its run
+FlowMonitor = Callable[..., Awaitable[None]]
+
+
+class IngestionPool:
+    """Create and execute the flows of uploaded documents in the background."""
+
+    def __init__(self, concurrency: int = INGESTION_CONCURRENCY):
+        self.concurrency = concurrency
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # Jobs queued or running in this worker, by transaction id
+        self._jobs: Dict[str, IngestionJob] = {}
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._stage_stats: Dict[str, QueryStats] = {}
+        self._execute_flow_run: Optional[FlowExecutor] = None
+        self._monitor_flow_run: Optional[FlowMonitor] = None
+        self._accepting = False
+        self._workers: List[asyncio.Task] = []
+        self._lease_task: Optional[asyncio.Task] = None
+        # Identifies this process's leases in ingestion_jobs, unique across
+        # restarts of a container (see FlowScheduler.owner)
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex}"
+
+    def _has_room(self) -> bool:
+        return self._accepting and len(self._jobs) < INGESTION_QUEUE_SIZE
+
+    async def add_job(
+        self,
+        transaction_id: str,
+        template_ids: List[str],
+        request_id: str = None,
+        connection: asyncpg.Connection = None,
+    ) -> IngestionJob:
+        """
+        Persist the job of an upload. It is leased to this worker if it has
+        room for it; submit() it once the transaction is committed.
+        """
+        leased = self._has_room()
+        await execute_query(
+            query=CREATE_INGESTION_JOB_QUERY,
+            params=(
+                transaction_id,
+                template_ids,
+                1 if leased else 0,
+                self.owner if leased else None,
+                INGESTION_LEASE_DURATION,
+            ),
+            request_id=request_id,
+            connection=connection,
+        )
+        return IngestionJob(
+            transaction_id=transaction_id,
+            template_ids=template_ids,
+            request_id=request_id,
+            leased=leased,
+        )
+
+    def submit(self, job: IngestionJob):
+        """Queue a persisted job; jobs leased to nobody are left to claims."""
+        if not job.leased or job.transaction_id in self._jobs:
+            return
+        self._jobs[job.transaction_id] = job
+        self._queue.put_nowait(job)
+
+    def stats(self) -> Dict:
+        return {
+            "queued": self._queue.qsize(),
+            "running": self._running,
+            "completed": self._completed,
+            "failed": self._failed,
+            "stages": {
+                name: stats.as_dict() for name, stats in self._stage_stats.items()
+            },
+        }
+
+    async def start(self, execute_flow_run: FlowExecutor, monitor_flow_run: FlowMonitor):
+        """Start the workers with the functions executing and monitoring flows."""
+        self._execute_flow_run = execute_flow_run
+        self._monitor_flow_run = monitor_flow_run
+        self._accepting = True
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(self.concurrency)
+        ]
+        self._lease_task = asyncio.create_task(self._run_leases())
+
+    async def stop(self):
+        """
+        Stop accepting jobs, give the queued and running ones
+        INGESTION_DRAIN_TIMEOUT seconds to finish and hand the rest over to
+        other workers.
+        """
+        self._accepting = False
+        if self._lease_task:
+            self._lease_task.cancel()
+            await asyncio.gather(self._lease_task, return_exceptions=True)
+            self._lease_task = None
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=INGESTION_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning(f"Ingestion drain timed out with {len(self._jobs)} jobs left")
+
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        try:
+            await execute_query(
+                query=RELEASE_INGESTION_JOB_LEASES_QUERY,
+                params=(self.owner,),
+            )
+        except Exception as e:
+            log.error(f"Failed to release ingestion job leases: {str(e)}")
+        log.info(f"Ingestion pool stopped with {len(self._jobs)} jobs left")
+        self._jobs.clear()
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if not job.lost:
+                    self._running += 1
+                    try:
+                        await self._process(job)
+                    finally:
+                        self._running -= 1
+            finally:
+                self._jobs.pop(job.transaction_id, None)
+                self._queue.task_done()
+
+    async def _process(self, job: IngestionJob):
+        started = time.monotonic()
+        try:
+            await self._run_stage(job, "template", self._put_template)
+            if not job.flow_id:
+                await self._run_stage(job, "create_flow", self._create_flow)
+            if not job.executed:
+                if job.execute_started:
+                    # A previous attempt died while the flow service was called
+                    raise IngestionError(
+                        f"Flow {job.flow_id} may already be running, "
+                        "not executing it again"
+                    )
+                # Only resent when the request never left
+                await self._run_stage(
+                    job,
+                    "execute_flow",
+                    self._execute_flow,
+                    retry_on=(CircuitOpenError,),
+                )
+                await self._run_stage(job, "record_execution", self._record_execution)
+            await self._run_stage(job, "monitor_flow", self._monitor_flow)
+            await execute_query(
+                query=COMPLETE_INGESTION_JOB_QUERY,
+                params=(job.transaction_id,),
+                request_id=job.request_id,
+            )
+            self._completed += 1
+            log.info(
+                f"Ingested {job.transaction_id} in "
+                f"{time.monotonic() - started:.2f}s"
+            )
+        except asyncio.CancelledError:
+            raise
+        except LeaseLostError:
+            log.warning(f"Lost the lease of ingestion job {job.transaction_id}")
+        except Exception as e:
+            if job.executed:
+                # The flow runs; only its bookkeeping is retried, by a later claim
+                log.error(
+                    f"Failed to monitor the flow of {job.transaction_id}: {str(e)}"
+                )
+                await self._release(job)
+            else:
+                log.error(f"Failed to ingest {job.transaction_id}: {str(e)}")
+                await self._fail(job, str(e))
+
+    async def _run_stage(
+        self,
+        job: IngestionJob,
+        name: str,
+        stage: Callable[[IngestionJob], Awaitable[None]],
+        retry_on: Tuple[Type[Exception], ...] = (Exception,),
+    ):
+        stats = self._stage_stats.setdefault(name, QueryStats())
+        attempt = 1
+        while True:
+            if job.lost:
+                raise LeaseLostError(job.transaction_id)
+
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(stage(job), timeout=INGESTION_STAGE_TIMEOUT)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                stats.observe(elapsed_ms)
+                log.debug(
+                    f"Ingestion stage {name} of {job.transaction_id} took "
+                    f"{elapsed_ms:.1f}ms"
+                )
+                return
+            except Exception as e:
+                stats.observe((time.perf_counter() - started) * 1000, failed=True)
+                if (
+                    isinstance(e, IngestionError)
+                    or not isinstance(e, retry_on)
+                    or attempt >= INGESTION_STAGE_ATTEMPTS
+                ):
+                    raise
+
+                delay = random.uniform(0, INGESTION_RETRY_BACKOFF * 2**attempt)
+                log.warning(
+                    f"Ingestion stage {name} of {job.transaction_id} failed: "
+                    f"{e!r}, retry {attempt} in {delay:.2f}s"
+                )
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _put_template(self, job: IngestionJob):
+        """Write the template.json the flow reads its templates from."""
+        templates_by_id = await catalog_cache.get_templates_by_id(
+            template_ids=list(dict.fromkeys(job.template_ids)),
+            request_id=job.request_id,
+        )
+        missing = [tid for tid in job.template_ids if tid not in templates_by_id]
+        if missing:
+            raise IngestionError(f"Templates {', '.join(missing)} do not exist")
+
+        if len(job.template_ids) == 1:
+            processing_type = "single"
+        elif len(set(job.template_ids)) == 1:
+            processing_type = "combined"
+        else:
+            processing_type = "multiple"
+
+        await get_s3_client().put_object(
+            Bucket=S3_BUCKET_NAME,
+            Key=f"{job.transaction_id}/template/template.json",
+            Body=encode_json(
+                [templates_by_id[tid] for tid in job.template_ids], indent=True
+            ),
+            ContentType="application/json",
+            Metadata={"processing_type": processing_type},
+        )
+
+    async def _create_flow(self, job: IngestionJob):
+        flow = await get_pinazu_client().create_flow(job.transaction_id)
+        if not flow.get("id"):
+            raise IngestionError(f"Flow service returned no flow id: {flow}")
+        await execute_query(
+            query=SET_INGESTION_FLOW_QUERY,
+            params=(job.transaction_id, flow["id"]),
+            request_id=job.request_id,
+        )
+        job.flow_id = flow["id"]
+
+    async def _execute_flow(self, job: IngestionJob):
+        if not job.execute_started:
+            await execute_query(
+                query=START_INGESTION_EXECUTION_QUERY,
+                params=(job.transaction_id,),
+                request_id=job.request_id,
+            )
+            job.execute_started = True
+        execute_flow_info = await self._execute_flow_run(
+            job.flow_id, job.transaction_id
+        )
+        job.flow_run_id = execute_flow_info.get("flow_run_id")
+        job.flow_status = execute_flow_info.get("status")
+        job.executed = True
+
+    async def _record_execution(self, job: IngestionJob):
+        await execute_query(
+            query=SET_INGESTION_FLOW_RUN_QUERY,
+            params=(job.transaction_id, job.flow_run_id, job.flow_status),
+            request_id=job.request_id,
+        )
+
+    async def _monitor_flow(self, job: IngestionJob):
+        await self._monitor_flow_run(
+            flow_id=job.flow_id,
+            flow_run_id=job.flow_run_id,
+            transaction_id=job.transaction_id,
+            status=job.flow_status,
+            request_id=job.request_id,
+        )
+
+    async def _release(self, job: IngestionJob):
+        try:
+            await execute_query(
+                query=RELEASE_INGESTION_JOB_QUERY,
+                params=(job.transaction_id, self.owner),
+                request_id=job.request_id,
+            )
+        except Exception as e:
+            log.error(f"Failed to release {job.transaction_id}: {str(e)}")
+
+    async def _fail(self, job: IngestionJob, error: str):
+        self._failed += 1
+        try:
+            documents = await execute_query(
+                query=FAIL_INGESTION_JOB_QUERY,
+                params=(job.transaction_id, error, FAILED_STATUS),
+                request_id=job.request_id,
+            )
+            await publish_document_events(
+                [{"type": "status", **document} for document in documents],
+                request_id=job.request_id,
+            )
+        except Exception as e:
+            log.error(f"Failed to record failure of {job.transaction_id}: {str(e)}")
+
+    async def _run_leases(self):
+        """Renew this worker's leases and claim jobs nobody is running."""
+        while True:
+            try:
+                await self._renew_leases()
+                await self._claim_jobs()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Failed to refresh ingestion job leases: {str(e)}")
+            await asyncio.sleep(INGESTION_LEASE_DURATION / 3)
+
+    async def _renew_leases(self):
+        # Jobs submitted while renewing may not be visible to the query yet
+        jobs = list(self._jobs.values())
+        rows = await execute_query(
+            query=RENEW_INGESTION_JOB_LEASES_QUERY,
+            params=(self.owner, INGESTION_LEASE_DURATION),
+        )
+        leased = {row["transaction_id"] for row in rows}
+        # Jobs taken over after our lease expired stop before their next stage
+        for job in jobs:
+            if job.transaction_id not in leased:
+                job.lost = True
+
+    async def _claim_jobs(self):
+        room = INGESTION_QUEUE_SIZE - len(self._jobs)
+        if not self._accepting or room <= 0:
+            return
+        rows = await execute_query(
+            query=CLAIM_INGESTION_JOBS_QUERY,
+            params=(self.owner, INGESTION_LEASE_DURATION, room),
+        )
+        for row in rows:
+            job = IngestionJob(
+                transaction_id=row["transaction_id"],
+                template_ids=list(row["template_ids"]),
+                request_id=None,
+                flow_id=row["flow_id"],
+                execute_started=row["execute_started"],
+                executed=row["executed"],
+                flow_run_id=row["flow_run_id"],
+                flow_status=row["flow_status"],
+            )
+            # Executed jobs only have bookkeeping left, never given up on
+            if row["attempts"] > INGESTION_MAX_CLAIMS and not job.executed:
+                await self._fail(job, f"Gave up after {row['attempts'] - 1} attempts")
+            else:
+                self.submit(job)
+        if rows:
+            log.info(f"Claimed {len(rows)} ingestion jobs")
+
+
+ingestion_pool = IngestionPool()
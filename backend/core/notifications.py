@@ -0,0 +1,139 @@
+import os
+import asyncio
+import asyncpg
+
+from logsim import CustomLogger
+from typing import Callable, Dict, List, Optional
+
+from core.database import execute_query
+from core.queries import register
+
+log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
+
+# Seconds to wait before reconnecting a lost listener connection
+LISTENER_RECONNECT_DELAY = float(os.getenv("PG_LISTENER_RECONNECT_DELAY", 2))
+
+NOTIFY_QUERY = register(
+    "notifications.notify",
+    """
+        SELECT pg_notify($1, $2)
+    """,
+)
+
+
+class PgListener:
+    """
+    Dispatch Postgres NOTIFY messages to in-process callbacks.
+
+    One dedicated connection (outside the pool) LISTENs on every subscribed
+    channel. Callbacks receive the notification payload, or None right after
+    the connection is (re)established, since messages sent while it was down
+    are lost and subscribers have to assume anything may have changed.
+    """
+
+    def __init__(self):
+        self._callbacks: Dict[str, List[Callable[[Optional[str]], None]]] = {}
+        self._connect_kwargs: Dict = {}
+        self._connection: Optional[asyncpg.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, channel: str, callback: Callable[[Optional[str]], None]):
+        """Register a callback for a channel. Must be called before start()."""
+        if self._task:
+            raise RuntimeError("Cannot subscribe after the listener has started")
+        self._callbacks.setdefault(channel, []).append(callback)
+
+    async def start(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        database: str,
+    ):
+        """Start listening in the background."""
+        self._connect_kwargs = {
+            "host": host,
+            "port": port,
+            "user": username,
+            "password": password,
+            "database": database,
+        }
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop listening and close the connection."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        log.info("Notification listener stopped")
+
+    async def _run(self):
+        """Keep a listening connection open, reconnecting when it drops."""
+        while True:
+            terminated = asyncio.Event()
+            try:
+                self._connection = await asyncpg.connect(**self._connect_kwargs)
+                self._connection.add_termination_listener(
+                    lambda connection: terminated.set()
+                )
+                for channel in self._callbacks:
+                    await self._connection.add_listener(channel, self._dispatch)
+                log.info(f"Listening on channels: {', '.join(self._callbacks)}")
+
+                for channel in self._callbacks:
+                    self._notify_subscribers(channel, None)
+
+                await terminated.wait()
+                log.warning("Notification listener connection lost")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Notification listener error: {str(e)}")
+            finally:
+                if self._connection and not self._connection.is_closed():
+                    await self._connection.close()
+                self._connection = None
+
+            await asyncio.sleep(LISTENER_RECONNECT_DELAY)
+
+    def _dispatch(
+        self,
+        connection: asyncpg.Connection,
+        pid: int,
+        channel: str,
+        payload: str,
+    ):
+        """asyncpg listener callback."""
+        self._notify_subscribers(channel, payload)
+
+    def _notify_subscribers(self, channel: str, payload: Optional[str]):
+        for callback in self._callbacks.get(channel, []):
+            try:
+                callback(payload)
+            except Exception as e:
+                log.error(f"Error handling notification on {channel}: {str(e)}")
+
+
+async def notify(
+    channel: str,
+    payload: str = "",
+    request_id: str = None,
+    connection: asyncpg.Connection = None,
+):
+    """
+    Send a notification to every worker listening on a channel.
+    """
+    await execute_query(
+        query=NOTIFY_QUERY,
+        params=(channel, payload),
+        request_id=request_id,
+        connection=connection,
+    )
+
+
+pg_listener = PgListener()
@@ -0,0 +1,127 @@
+import json
+import base64
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Upper bound for the `limit` query parameter on list endpoints
+MAX_PAGE_SIZE = 500
+
+# Response header carrying the cursor of the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def encode_cursor(sort_value: Any, id_value: Any) -> str:
+    """
+    Encode the sort key of the last row of a page into an opaque cursor.
+    """
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    payload = json.dumps([sort_value, str(id_value)]).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    Decode a cursor produced by encode_cursor back into (timestamp, id).
+    """
+    try:
+        sort_value, id_value = json.loads(base64.urlsafe_b64decode(cursor))
+        return datetime.fromisoformat(sort_value), id_value
+    except Exception as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+
+def build_list_query(
+    base_query: str,
+    filters: Dict[str, Any],
+    sort_column: str,
+    id_column: str,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> Tuple[str, tuple]:
+    """
+    Append filters, a keyset condition and ordering to a list query.
+
+    `filters` maps column names to values; None values are skipped. The keyset
+    condition compares (sort_column, id_column) against the decoded cursor so
+    the database can seek directly into the matching composite index. Ids are
+    compared under the "C" collation so ties order bytewise, the same way
+    paginate_rows compares them in memory. When `limit` is given one extra row
+    is requested to detect a following page.
+    """
+    clauses: List[str] = []
+    params: List[Any] = []
+    id_key = f'{id_column} COLLATE "C"'
+
+    for column, value in filters.items():
+        if value is None:
+            continue
+        params.append(value)
+        clauses.append(f"{column} = ${len(params)}")
+
+    if after:
+        after_sort, after_id = decode_cursor(after)
+        params.extend([after_sort, after_id])
+        clauses.append(
+            f"({sort_column}, {id_key}) < (${len(params) - 1}, ${len(params)})"
+        )
+
+    query = base_query
+    if clauses:
+        query += "\nWHERE " + " AND ".join(clauses)
+    query += f"\nORDER BY {sort_column} DESC, {id_key} DESC"
+    if limit:
+        params.append(limit + 1)
+        query += f"\nLIMIT ${len(params)}"
+
+    return query, tuple(params)
+
+
+def split_page(
+    rows: List[Dict],
+    limit: int,
+    sort_key: str,
+) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Trim the extra row requested by build_list_query and return the page
+    together with the cursor of the next page, if any.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(page[-1][sort_key], page[-1]["id"])
+
+
+def paginate_rows(
+    rows: List[Dict],
+    sort_key: str,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Apply the same keyset pagination as build_list_query to rows already held
+    in memory and sorted by (sort_key, id) descending, with ids ordered
+    bytewise as under the "C" collation.
+    """
+    if after:
+        after_sort, after_id = decode_cursor(after)
+        rows = [
+            row
+            for row in rows
+            if (_as_datetime(row[sort_key]), str(row["id"])) < (after_sort, after_id)
+        ]
+    if not limit:
+        return rows, None
+    return split_page(rows[: limit + 1], limit, sort_key)
+
+
+def _as_datetime(value: Any) -> datetime:
+    """Get a datetime from a timestamp column that may be an ISO string."""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
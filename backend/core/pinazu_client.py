@@ -0,0 +1,232 @@
+import os
+import time
+import httpx
+import random
+import asyncio
+
+from logsim import CustomLogger
+from typing import Any, Dict, Optional
+
+log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
+
+# Base URL of the pinazu flow service; point it at a stub server for testing
+PINAZU_URL = os.getenv("PINAZU_URL", "http://pinazu:8081")
+PINAZU_MAX_CONNECTIONS = int(os.getenv("PINAZU_MAX_CONNECTIONS", 20))
+# Per-call timeouts in seconds
+PINAZU_CONNECT_TIMEOUT = float(os.getenv("PINAZU_CONNECT_TIMEOUT", 3))
+PINAZU_TIMEOUT = float(os.getenv("PINAZU_TIMEOUT", 10))
+# Retries of failed calls, with full-jitter exponential backoff
+PINAZU_MAX_RETRIES = int(os.getenv("PINAZU_MAX_RETRIES", 3))
+PINAZU_RETRY_BACKOFF = float(os.getenv("PINAZU_RETRY_BACKOFF", 0.5))
+# Consecutive failed calls that open the circuit, and seconds it stays open
+PINAZU_BREAKER_THRESHOLD = int(os.getenv("PINAZU_BREAKER_THRESHOLD", 5))
+PINAZU_BREAKER_RESET = float(os.getenv("PINAZU_BREAKER_RESET", 30))
+
+# Code location of the document processing flow
+FLOW_CODE_LOCATION = os.getenv(
+    "FLOW_CODE_LOCATION",
+    "s3://test-bucket-302010997939-ap-southeast-1/flows/mb-idp.py",
+)
+
+# Shared client instance, created in the app lifespan
+pinazu_client: Optional["PinazuClient"] = None
+
+
+class PinazuError(Exception):
+    """Raised when a call to the flow service fails."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitOpenError(PinazuError):
+    """Raised without calling the flow service while the circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing service for a while.
+
+    After `threshold` consecutive failures the circuit opens and calls fail
+    fast for `reset_timeout` seconds. Then a single trial call is let through
+    per `reset_timeout`: success closes the circuit, failure keeps it open.
+    """
+
+    def __init__(
+        self,
+        threshold: int = PINAZU_BREAKER_THRESHOLD,
+        reset_timeout: float = PINAZU_BREAKER_RESET,
+    ):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call must not be made."""
+        state = self.state
+        if state == "open":
+            raise CircuitOpenError("Flow service circuit is open")
+        if state == "half-open":
+            # Let this call through as the trial and hold back the others
+            self._opened_at = time.monotonic()
+
+    def record_success(self):
+        if self._opened_at is not None:
+            log.info("Flow service circuit closed")
+        self._failures = 0
+        self._opened_at = None
+
+    def record_failure(self):
+        self._failures += 1
+        if self._opened_at is None and self._failures >= self.threshold:
+            log.warning(f"Flow service circuit opened after {self._failures} failures")
+        if self._opened_at is not None or self._failures >= self.threshold:
+            self._opened_at = time.monotonic()
+
+
+class PinazuClient:
+    """
+    Async client of the pinazu flow service.
+
+    One httpx client keeps a pool of keep-alive connections shared by every
+    request of the worker. Calls that fail with a transport error or a 5xx/429
+    response are retried with jittered backoff; POSTs are only retried when
+    the request never reached the server, so a flow is never executed twice.
+    A circuit breaker fails calls fast while the service is down.
+    """
+
+    def __init__(
+        self,
+        base_url: str = PINAZU_URL,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        max_retries: int = PINAZU_MAX_RETRIES,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            transport=transport,
+            timeout=httpx.Timeout(PINAZU_TIMEOUT, connect=PINAZU_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=PINAZU_MAX_CONNECTIONS,
+                max_keepalive_connections=PINAZU_MAX_CONNECTIONS,
+            ),
+        )
+
+    async def close(self):
+        await self._client.aclose()
+
+    async def create_flow(self, transaction_id: str) -> Dict:
+        """Create the processing flow of a transaction."""
+        return await self._request(
+            "POST",
+            "/v1/flows",
+            json={
+                "name": transaction_id,
+                "parameters_schema": {
+                    "job_id": transaction_id,
+                },
+                "engine": "process",
+                "code_location": FLOW_CODE_LOCATION,
+                "entrypoint": "python",
+                "tags": ["mb", "idp"],
+            },
+        )
+
+    async def execute_flow(
+        self,
+        flow_id: str,
+        transaction_id: str,
+        callback_url: Optional[str] = None,
+    ) -> Dict:
+        """Start a run of a flow, optionally asking for status callbacks."""
+        parameters = {"job_id": transaction_id}
+        if callback_url:
+            parameters["callback_url"] = callback_url
+        return await self._request(
+            "POST",
+            f"/v1/flows/{flow_id}/execute",
+            json={"parameters": parameters},
+        )
+
+    async def get_flow_status(self, flow_run_id: str) -> Dict:
+        """Get the status of a flow run."""
+        return await self._request("GET", f"/v1/flows/{flow_run_id}/status")
+
+    async def _request(self, method: str, path: str, **kwargs) -> Any:
+        self.breaker.before_call()
+
+        attempt = 0
+        while True:
+            try:
+                response = await self._client.request(method, path, **kwargs)
+                if response.status_code < 500 and response.status_code != 429:
+                    # The service answered, even if it rejected the request
+                    self.breaker.record_success()
+                    if response.is_error:
+                        raise PinazuError(
+                            f"{method} {path} failed with {response.status_code}: "
+                            f"{response.text}",
+                            status_code=response.status_code,
+                        )
+                    return response.json()
+                error = PinazuError(
+                    f"{method} {path} failed with {response.status_code}",
+                    status_code=response.status_code,
+                )
+                # A 429 was refused before doing anything, so it is safe to resend
+                retryable = method == "GET" or response.status_code == 429
+            except httpx.TransportError as e:
+                error = PinazuError(f"{method} {path} failed: {e!r}")
+                retryable = method == "GET" or isinstance(
+                    e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+                )
+
+            if not retryable or attempt >= self.max_retries:
+                self.breaker.record_failure()
+                raise error
+
+            delay = random.uniform(0, PINAZU_RETRY_BACKOFF * 2**attempt)
+            attempt += 1
+            log.warning(f"{error}, retry {attempt} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+async def init_pinazu_client():
+    """
+    Create the flow service client shared by every request of this worker.
+    """
+    global pinazu_client
+    pinazu_client = PinazuClient()
+    log.info(f"Flow service client initialized for {PINAZU_URL}")
+
+
+async def close_pinazu_client():
+    """
+    Close the shared flow service client.
+    """
+    global pinazu_client
+    if pinazu_client:
+        await pinazu_client.close()
+        log.info("Flow service client closed")
+        pinazu_client = None
+
+
+def get_pinazu_client() -> PinazuClient:
+    """
+    Get the shared flow service client.
+    """
+    if not pinazu_client:
+        raise Exception("Flow service client not initialized")
+    return pinazu_client
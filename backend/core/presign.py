@@ -0,0 +1,111 @@
+import os
+import time
+
+from collections import OrderedDict
+from logsim import CustomLogger
+from typing import Dict, List, Optional, Tuple
+
+from core.s3_client import AsyncS3Client
+
+log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
+
+# Lifetime of the URLs signed on a cache miss. URLs signed with temporary
+# credentials stop working when those expire, so keep this well below their
+# lifetime
+PRESIGN_EXPIRES_IN = int(os.getenv("PRESIGN_EXPIRES_IN", 900))
+# Upper bound on the number of URLs kept per worker
+PRESIGN_CACHE_SIZE = int(os.getenv("PRESIGN_CACHE_SIZE", 10000))
+
+
+class PresignedUrlCache:
+    """
+    LRU cache of presigned URLs keyed on (bucket, key, method).
+
+    A cached URL is handed back as long as it stays valid for at least the
+    lifetime the caller asked for. Misses are signed for PRESIGN_EXPIRES_IN
+    seconds (or the requested lifetime, if longer) so the URL can be reused
+    by later requests. Misses of a batch are signed together in one thread
+    pool hop with the shared S3 client.
+    """
+
+    def __init__(
+        self,
+        max_size: int = PRESIGN_CACHE_SIZE,
+        expires_in: int = PRESIGN_EXPIRES_IN,
+    ):
+        self.max_size = max_size
+        self.expires_in = expires_in
+        # (bucket, key, method) -> (url, monotonic expiry)
+        self._urls: "OrderedDict[Tuple[str, str, str], Tuple[str, float]]" = (
+            OrderedDict()
+        )
+
+    async def get_url(
+        self,
+        s3_client: AsyncS3Client,
+        bucket: str,
+        key: str,
+        method: str = "get_object",
+        expires_in: int = 300,
+    ) -> str:
+        """Get a URL valid for at least expires_in seconds."""
+        urls = await self.get_urls(s3_client, bucket, [key], method, expires_in)
+        return urls[0]
+
+    async def get_urls(
+        self,
+        s3_client: AsyncS3Client,
+        bucket: str,
+        keys: List[str],
+        method: str = "get_object",
+        expires_in: int = 300,
+    ) -> List[str]:
+        """Get URLs valid for at least expires_in seconds, in the order of keys."""
+        now = time.monotonic()
+        urls: Dict[str, str] = {}
+        misses: List[str] = []
+        for key in dict.fromkeys(keys):
+            url = self._lookup((bucket, key, method), now + expires_in)
+            if url:
+                urls[key] = url
+            else:
+                misses.append(key)
+
+        if misses:
+            lifetime = max(self.expires_in, expires_in)
+            signed = await s3_client.generate_presigned_urls(
+                [
+                    {
+                        "ClientMethod": method,
+                        "Params": {"Bucket": bucket, "Key": key},
+                        "ExpiresIn": lifetime,
+                    }
+                    for key in misses
+                ]
+            )
+            # Measured from before signing so the expiry is never overestimated
+            for key, url in zip(misses, signed):
+                self._store((bucket, key, method), url, now + lifetime)
+                urls[key] = url
+            log.debug(f"Signed {len(misses)} URLs, reused {len(urls) - len(misses)}")
+
+        return [urls[key] for key in keys]
+
+    def _lookup(self, cache_key: Tuple[str, str, str], valid_until: float) -> Optional[str]:
+        entry = self._urls.get(cache_key)
+        if not entry:
+            return None
+        url, expires_at = entry
+        if expires_at < valid_until:
+            return None
+        self._urls.move_to_end(cache_key)
+        return url
+
+    def _store(self, cache_key: Tuple[str, str, str], url: str, expires_at: float):
+        self._urls[cache_key] = (url, expires_at)
+        self._urls.move_to_end(cache_key)
+        while len(self._urls) > self.max_size:
+            self._urls.popitem(last=False)
+
+
+presigned_url_cache = PresignedUrlCache()
@@ -0,0 +1,48 @@
+import numpy as np
+
+from typing import Any, Dict, List, Tuple
+
+# Lower bounds (exclusive) of the average page quality for each grade
+GOOD_QUALITY_THRESHOLD = 80
+FAIR_QUALITY_THRESHOLD = 60
+
+
+def grade_files(
+    files: Dict[str, List[Dict[str, Any]]],
+) -> Tuple[List[str], List[str], np.ndarray]:
+    """
+    Grade every file of a quality.json from the average overall_quality of
+    its pages.
+
+    All page scores are gathered into one array and averaged per file with a
+    single weighted bincount, instead of summing page by page in Python.
+    Returns the file names with a grade, their grades and their averages;
+    files without pages are left out.
+    """
+    names = list(files)
+    page_counts = np.fromiter(
+        (len(files[name]) for name in names), dtype=np.int64, count=len(names)
+    )
+    scores = np.fromiter(
+        (
+            page["quality_metrics"]["overall_quality"]
+            for name in names
+            for page in files[name]
+        ),
+        dtype=np.float64,
+        count=int(page_counts.sum()),
+    )
+    # Index of the file each page belongs to
+    file_index = np.repeat(np.arange(len(names)), page_counts)
+
+    totals = np.bincount(file_index, weights=scores, minlength=len(names))
+    graded = page_counts > 0
+    averages = totals[graded] / page_counts[graded]
+    grades = np.select(
+        [averages > GOOD_QUALITY_THRESHOLD, averages > FAIR_QUALITY_THRESHOLD],
+        ["good", "fair"],
+        default="poor",
+    )
+
+    graded_names = [name for name, has_pages in zip(names, graded) if has_pages]
+    return graded_names, grades.tolist(), averages
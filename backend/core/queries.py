@@ -0,0 +1,167 @@
+import os
+import re
+import bisect
+import hashlib
+import asyncpg
+
+from dataclasses import dataclass
+from asyncpg.prepared_stmt import PreparedStatement
+from logsim import CustomLogger
+from typing import Dict, List, Optional
+
+log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
+
+# Upper bounds (in milliseconds) of the latency histogram buckets
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+@dataclass(frozen=True)
+class Query:
+    """A named SQL statement."""
+
+    name: str
+    sql: str
+
+    def __str__(self) -> str:
+        return self.sql
+
+
+class QueryStats:
+    """Call count and latency histogram of a single statement."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def observe(self, elapsed_ms: float, failed: bool = False):
+        self.calls += 1
+        if failed:
+            self.errors += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+
+    def percentile(self, q: float) -> float:
+        """Estimate a percentile as the upper bound of the bucket it falls in."""
+        if not self.calls:
+            return 0.0
+        rank = q * self.calls
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                if index < len(LATENCY_BUCKETS_MS):
+                    return min(float(LATENCY_BUCKETS_MS[index]), self.max_ms)
+                break
+        return self.max_ms
+
+    def as_dict(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "mean_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+# Registered statements, prepared on every pool connection
+_registry: Dict[str, Query] = {}
+# Runtime statistics by statement name
+_stats: Dict[str, QueryStats] = {}
+# Prepared statements by server process id of the connection they live on
+_prepared: Dict[int, Dict[str, PreparedStatement]] = {}
+
+
+def register(name: str, sql: str) -> Query:
+    """
+    Register a named statement so it is prepared once per pool connection.
+    """
+    existing = _registry.get(name)
+    if existing and existing.sql != sql:
+        raise ValueError(f"Query {name} is already registered with different SQL")
+
+    query = Query(name=name, sql=sql)
+    _registry[name] = query
+    return query
+
+
+def fingerprint(sql: str) -> str:
+    """
+    Build a stable name for an unregistered statement from its normalized text.
+    """
+    normalized = re.sub(r"\s+", " ", sql).strip().lower()
+    return "adhoc:" + hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
+
+
+def query_name(query: Query | str) -> str:
+    """Get the name statistics are recorded under for a statement."""
+    if isinstance(query, Query):
+        return query.name
+    return fingerprint(query)
+
+
+def query_sql(query: Query | str) -> str:
+    """Get the SQL text of a statement."""
+    if isinstance(query, Query):
+        return query.sql
+    return query
+
+
+async def prepare_registered_queries(connection: asyncpg.Connection):
+    """
+    Prepare every registered statement on a new pool connection.
+
+    Used as the asyncpg pool `init` hook. Statements that fail to prepare (for
+    example because a migration has not created their table yet) are skipped
+    and run unprepared until the connection is recycled.
+    """
+    pid = connection.get_server_pid()
+    statements = {}
+    for query in list(_registry.values()):
+        try:
+            statements[query.name] = await connection.prepare(query.sql)
+        except asyncpg.PostgresError as e:
+            log.warning(f"Could not prepare query {query.name}: {str(e)}")
+
+    _prepared[pid] = statements
+    connection.add_termination_listener(lambda conn: _prepared.pop(pid, None))
+    log.debug(f"Prepared {len(statements)} queries on connection {pid}")
+
+
+def get_prepared(
+    connection: asyncpg.Connection,
+    query: Query | str,
+) -> Optional[PreparedStatement]:
+    """Get the prepared statement of a registered query on a connection."""
+    if not isinstance(query, Query):
+        return None
+    statements = _prepared.get(connection.get_server_pid())
+    if not statements:
+        return None
+    return statements.get(query.name)
+
+
+def record_query(name: str, elapsed_ms: float, failed: bool = False):
+    """Record the latency of one execution of a statement."""
+    stats = _stats.get(name)
+    if stats is None:
+        stats = _stats[name] = QueryStats()
+    stats.observe(elapsed_ms, failed)
+
+
+def get_query_stats() -> List[Dict]:
+    """
+    Get call counts and latency percentiles of every executed statement,
+    slowest p95 first.
+    """
+    result = [
+        {"name": name, "registered": name in _registry, **stats.as_dict()}
+        for name, stats in _stats.items()
+    ]
+    return sorted(result, key=lambda item: item["p95_ms"], reverse=True)
@@ -0,0 +1,109 @@
+import os
+import orjson
+
+from decimal import Decimal
+from logsim import CustomLogger
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List
+from fastapi.responses import JSONResponse as BaseJSONResponse
+from fastapi.responses import StreamingResponse
+
+log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _default(value: Any) -> Any:
+    """Serialize types orjson does not handle natively."""
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type {type(value).__name__} is not JSON serializable")
+
+
+def encode_json(content: Any, indent: bool = False) -> bytes:
+    """
+    Serialize content to JSON bytes.
+
+    datetimes are written as ISO 8601 strings and UUIDs as strings, so rows
+    coming from the database can be encoded without any preprocessing.
+    """
+    option = orjson.OPT_NON_STR_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(content, default=_default, option=option)
+
+
+class JSONResponse(BaseJSONResponse):
+    """JSON response rendered with orjson; the default for every route."""
+
+    def render(self, content: Any) -> bytes:
+        return encode_json(content)
+
+
+def wants_ndjson(accept: str | None) -> bool:
+    """
+    Check whether the client asked for newline-delimited JSON.
+    """
+    return bool(accept) and NDJSON_MEDIA_TYPE in accept
+
+
+async def stream_json_response(
+    batches: AsyncGenerator[List[Dict], None],
+    ndjson: bool = False,
+    status_code: int = 200,
+) -> StreamingResponse:
+    """
+    Build a streaming response from batches of rows.
+
+    The first batch is pulled before the response is created, so errors raised
+    while running the query still surface to the caller instead of breaking a
+    response that has already started.
+    """
+    first_batch = await anext(batches, None)
+
+    if ndjson:
+        body = _iter_ndjson(first_batch, batches)
+        media_type = NDJSON_MEDIA_TYPE
+    else:
+        body = _iter_json_array(first_batch, batches)
+        media_type = "application/json"
+
+    return StreamingResponse(body, status_code=status_code, media_type=media_type)
+
+
+async def _iter_json_array(
+    first_batch: List[Dict] | None,
+    batches: AsyncGenerator[List[Dict], None],
+) -> AsyncIterator[bytes]:
+    """Yield a JSON array one batch of rows at a time."""
+    try:
+        yield b"["
+        if first_batch is not None:
+            yield b",".join(encode_json(row) for row in first_batch)
+            async for batch in batches:
+                yield b"," + b",".join(encode_json(row) for row in batch)
+        yield b"]"
+    except Exception as e:
+        log.error(f"Stream aborted while sending JSON array: {str(e)}")
+        raise
+    finally:
+        # Release the cursor connection even if the client went away
+        await batches.aclose()
+
+
+async def _iter_ndjson(
+    first_batch: List[Dict] | None,
+    batches: AsyncGenerator[List[Dict], None],
+) -> AsyncIterator[bytes]:
+    """Yield one JSON document per line, one batch of rows at a time."""
+    try:
+        if first_batch is None:
+            return
+        yield b"".join(encode_json(row) + b"\n" for row in first_batch)
+        async for batch in batches:
+            yield b"".join(encode_json(row) + b"\n" for row in batch)
+    except Exception as e:
+        log.error(f"Stream aborted while sending NDJSON: {str(e)}")
+        raise
+    finally:
+        # Release the cursor connection even if the client went away
+        await batches.aclose()
@@ -1,14 +1,187 @@
 import os
 import boto3
+import asyncio
+import functools
 
 from logsim import CustomLogger
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
 
 # Database pool instance
 log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
 
+S3_REGION = os.getenv("S3_REGION", "ap-southeast-1")
+# Point at a local S3-compatible server (MinIO, moto, localstack) for testing
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+# Maximum number of S3 calls in flight per worker
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", 32))
+# Retry policy and timeouts of the shared client
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", 5))
+S3_RETRY_MODE = os.getenv("S3_RETRY_MODE", "adaptive")
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", 5))
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", 60))
 
-def get_s3_client():
+# Largest number of keys accepted by one DeleteObjects call
+S3_DELETE_BATCH_SIZE = 1000
+
+# Shared client instance, created in the app lifespan
+s3_client: Optional["AsyncS3Client"] = None
+
+
+def create_s3_client():
+    """
+    Build a boto3 S3 client with a connection pool sized for S3_MAX_CONCURRENCY
+    and the configured retry policy.
+    """
     return boto3.client(
         service_name="s3",
-        region_name="ap-southeast-1",
+        region_name=S3_REGION,
+        endpoint_url=S3_ENDPOINT_URL,
+        config=Config(
+            max_pool_connections=S3_MAX_CONCURRENCY,
+            retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": S3_RETRY_MODE},
+            connect_timeout=S3_CONNECT_TIMEOUT,
+            read_timeout=S3_READ_TIMEOUT,
+            tcp_keepalive=True,
+        ),
+    )
+
+
+async def init_s3_client():
+    """
+    Create the S3 client shared by every request of this worker.
+    """
+    global s3_client
+    s3_client = AsyncS3Client()
+    log.info(f"S3 client initialized with {S3_MAX_CONCURRENCY} connections")
+
+
+async def close_s3_client():
+    """
+    Close the shared S3 client.
+    """
+    global s3_client
+    if s3_client:
+        await s3_client.close()
+        log.info("S3 client closed")
+        s3_client = None
+
+
+def get_s3_client() -> "AsyncS3Client":
+    """
+    Get the shared S3 client.
+    """
+    if not s3_client:
+        raise Exception("S3 client not initialized")
+    return s3_client
+
+
+class AsyncS3Client:
+    """
+    Async facade over a boto3 S3 client.
+
+    Every network call runs on a bounded thread pool so a slow S3 round trip
+    never blocks the event loop; at most S3_MAX_CONCURRENCY calls are in flight
+    per worker, matching the client's connection pool. boto3 clients are thread
+    safe, so one instance serves every request.
+    """
+
+    def __init__(self, client: Any = None, max_concurrency: int = S3_MAX_CONCURRENCY):
+        self.client = client or create_s3_client()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix="s3",
+        )
+
+    async def close(self):
+        """Wait for in-flight calls, then release the threads and connections."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._executor.shutdown)
+        self.client.close()
+
+    async def _run(self, fn: Callable, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(fn, **kwargs)
+        )
+
+    async def put_object(self, **kwargs) -> Dict:
+        return await self._run(self.client.put_object, **kwargs)
+
+    async def get_object(self, **kwargs) -> Dict:
+        """Get an object; its Body is read on the thread pool and returned as bytes."""
+        return await self._run(self._get_object, **kwargs)
+
+    def _get_object(self, **kwargs) -> Dict:
+        response = self.client.get_object(**kwargs)
+        response["Body"] = response["Body"].read()
+        return response
+
+    async def delete_object(self, **kwargs) -> Dict:
+        return await self._run(self.client.delete_object, **kwargs)
+
+    async def generate_presigned_url(self, **kwargs) -> str:
+        # Signing is local, but resolving or refreshing credentials is not
+        return await self._run(self.client.generate_presigned_url, **kwargs)
+
+    async def generate_presigned_urls(self, requests: List[Dict]) -> List[str]:
+        """Sign many URLs in one thread pool hop; each request is a kwargs dict."""
+        return await self._run(self._generate_presigned_urls, requests=requests)
+
+    def _generate_presigned_urls(self, requests: List[Dict]) -> List[str]:
+        return [self.client.generate_presigned_url(**kwargs) for kwargs in requests]
+
+    async def create_multipart_upload(self, **kwargs) -> Dict:
+        return await self._run(self.client.create_multipart_upload, **kwargs)
+
+    async def upload_part(self, **kwargs) -> Dict:
+        return await self._run(self.client.upload_part, **kwargs)
+
+    async def complete_multipart_upload(self, **kwargs) -> Dict:
+        return await self._run(self.client.complete_multipart_upload, **kwargs)
+
+    async def abort_multipart_upload(self, **kwargs) -> Dict:
+        return await self._run(self.client.abort_multipart_upload, **kwargs)
+
+    async def list_objects_v2(self, **kwargs) -> Dict:
+        return await self._run(self.client.list_objects_v2, **kwargs)
+
+    async def delete_objects(self, **kwargs) -> Dict:
+        return await self._run(self.client.delete_objects, **kwargs)
+
+
+async def list_keys(s3_client: AsyncS3Client, bucket: str, prefix: str) -> List[str]:
+    """
+    List every key under a prefix.
+    """
+    keys = []
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        response = await s3_client.list_objects_v2(**kwargs)
+        keys.extend(item["Key"] for item in response.get("Contents", []))
+        if not response.get("IsTruncated"):
+            return keys
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+
+async def delete_keys(s3_client: AsyncS3Client, bucket: str, keys: List[str]) -> List[Dict]:
+    """
+    Delete keys with concurrent DeleteObjects calls of up to
+    S3_DELETE_BATCH_SIZE keys each. Returns the keys S3 failed to delete.
+    """
+    responses = await asyncio.gather(
+        *(
+            s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={
+                    "Objects": [
+                        {"Key": key} for key in keys[i : i + S3_DELETE_BATCH_SIZE]
+                    ],
+                    "Quiet": True,
+                },
+            )
+            for i in range(0, len(keys), S3_DELETE_BATCH_SIZE)
+        )
     )
+    return [error for response in responses for error in response.get("Errors", [])]
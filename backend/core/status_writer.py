@@ -0,0 +1,110 @@
+import os
+import asyncio
+
+from logsim import CustomLogger
+from typing import Dict, Optional
+
+from core.database import execute_query
+from core.events import publish_document_events
+from core.queries import register
+
+log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
+
+# Seconds between two flushes of pending document status transitions
+STATUS_FLUSH_INTERVAL = float(os.getenv("STATUS_FLUSH_INTERVAL", 1))
+
+# Queries
+FLUSH_DOCUMENT_STATUSES_QUERY = register(
+    "status_writer.flush_document_statuses",
+    """
+        UPDATE documents d
+        SET status = u.status, updated_at = NOW()
+        FROM unnest($1::text[], $2::text[]) AS u(flow_id, status)
+        WHERE d.flow_id = u.flow_id
+          AND d.status IS DISTINCT FROM u.status
+        RETURNING d.id, d.flow_id, d.status
+    """,
+)
+
+
+class DocumentStatusWriter:
+    """Write the document status transitions of many flows in batched UPDATEs."""
+
+    def __init__(self, interval: float = STATUS_FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending: Dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+        # Keeps a flush from landing after, and overwriting, a direct write
+        self._lock = asyncio.Lock()
+
+    def submit(self, flow_id: str, status: str):
+        """Queue the new status of a flow's documents; the latest one wins."""
+        self._pending[flow_id] = status
+
+    async def write(self, flow_id: str, status: str, request_id: str = None):
+        """
+        Write the status of a flow's documents right away, superseding any
+        pending one; raises when the write fails.
+        """
+        async with self._lock:
+            self._pending.pop(flow_id, None)
+            rows = await execute_query(
+                query=FLUSH_DOCUMENT_STATUSES_QUERY,
+                params=([flow_id], [status]),
+                request_id=request_id,
+            )
+        await publish_document_events(
+            [{"type": "status", **row} for row in rows],
+            request_id=request_id,
+        )
+
+    async def start(self):
+        """Start flushing in the background."""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop flushing and write whatever is still pending."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        log.info("Document status writer stopped")
+
+    async def flush(self):
+        """Write every pending transition in one statement."""
+        async with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            try:
+                rows = await execute_query(
+                    query=FLUSH_DOCUMENT_STATUSES_QUERY,
+                    params=(list(pending.keys()), list(pending.values())),
+                )
+                log.debug(f"Flushed status of {len(pending)} flows")
+            except Exception as e:
+                log.error(
+                    f"Failed to flush {len(pending)} document statuses: {str(e)}"
+                )
+                # Retry on the next flush unless a newer status came in meanwhile
+                for flow_id, status in pending.items():
+                    self._pending.setdefault(flow_id, status)
+                return
+
+        try:
+            await publish_document_events([{"type": "status", **row} for row in rows])
+        except Exception as e:
+            log.error(f"Failed to publish document status events: {str(e)}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            # A flush interrupted by stop() still completes
+            await asyncio.shield(self.flush())
+
+
+document_status_writer = DocumentStatusWriter()
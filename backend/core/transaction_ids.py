@@ -0,0 +1,71 @@
+import os
+import asyncio
+import asyncpg
+
+from datetime import datetime
+from logsim import CustomLogger
+
+from core.database import execute_query
+from core.queries import register
+
+log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
+
+TRANSACTION_ID_PREFIX = "XDP"
+# Ids reserved by one nextval; must match INCREMENT BY of transaction_id_seq
+TRANSACTION_ID_BLOCK_SIZE = 100
+
+NEXT_TRANSACTION_ID_BLOCK_QUERY = register(
+    "transaction_ids.next_block",
+    """
+        SELECT nextval('transaction_id_seq') AS block_start
+    """,
+)
+
+
+class TransactionIdAllocator:
+    """
+    Hand out transaction ids from blocks reserved on a Postgres sequence.
+
+    Ids look like XDP{yymm}{number}. The number comes from a sequence shared by
+    every worker, so ids are unique by construction and only one query is made
+    per TRANSACTION_ID_BLOCK_SIZE ids.
+    """
+
+    def __init__(self, block_size: int = TRANSACTION_ID_BLOCK_SIZE):
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def allocate(
+        self,
+        request_id: str = None,
+        connection: asyncpg.Connection = None,
+    ) -> str:
+        """Allocate a new transaction id."""
+        async with self._lock:
+            if self._next >= self._end:
+                await self._reserve_block(request_id, connection)
+            number = self._next
+            self._next += 1
+
+        return f"{TRANSACTION_ID_PREFIX}{datetime.now():%y%m}{number}"
+
+    async def _reserve_block(
+        self,
+        request_id: str = None,
+        connection: asyncpg.Connection = None,
+    ):
+        """Reserve the next block of numbers from the sequence."""
+        result = await execute_query(
+            query=NEXT_TRANSACTION_ID_BLOCK_QUERY,
+            params=(),
+            request_id=request_id,
+            connection=connection,
+        )
+        self._next = result[0]["block_start"]
+        self._end = self._next + self.block_size
+        log.debug(f"Reserved transaction ids {self._next} to {self._end - 1}")
+
+
+transaction_id_allocator = TransactionIdAllocator()
@@ -0,0 +1,136 @@
+import os
+import asyncio
+import hashlib
+
+from fastapi import UploadFile
+from logsim import CustomLogger
+from typing import Dict, List, NamedTuple, Optional
+
+from core.s3_client import AsyncS3Client
+
+log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
+
+# Size of each multipart part; S3 requires at least 5 MiB for all but the last
+S3_UPLOAD_PART_SIZE = max(
+    int(os.getenv("S3_UPLOAD_PART_SIZE", 5 * 1024 * 1024)), 5 * 1024 * 1024
+)
+# Number of files of one request uploaded at the same time
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", 2))
+
+
+class UploadedObject(NamedTuple):
+    """Result of streaming one file to S3."""
+
+    key: str
+    size: int
+    sha256: str
+
+
+async def upload_file(
+    s3_client: AsyncS3Client,
+    file: UploadFile,
+    bucket: str,
+    key: str,
+    content_type: Optional[str] = None,
+    metadata: Optional[Dict[str, str]] = None,
+) -> UploadedObject:
+    """
+    Stream an uploaded file to S3 one part at a time.
+
+    At most one part is held in memory, so memory use does not depend on the
+    size of the file. Files smaller than a part are sent with a single
+    put_object; larger ones go through a multipart upload, which is aborted if
+    anything fails so no orphaned parts are left behind. The sha256 of the
+    content is computed while streaming.
+    """
+    extra = {
+        "ContentType": content_type or "application/octet-stream",
+        "Metadata": metadata or {},
+    }
+    digest = hashlib.sha256()
+
+    chunk = await file.read(S3_UPLOAD_PART_SIZE)
+    digest.update(chunk)
+    if len(chunk) < S3_UPLOAD_PART_SIZE:
+        await s3_client.put_object(Bucket=bucket, Key=key, Body=chunk, **extra)
+        return UploadedObject(key=key, size=len(chunk), sha256=digest.hexdigest())
+
+    upload = await s3_client.create_multipart_upload(Bucket=bucket, Key=key, **extra)
+    upload_id = upload["UploadId"]
+    parts: List[Dict] = []
+    size = 0
+    try:
+        while chunk:
+            part_number = len(parts) + 1
+            part = await s3_client.upload_part(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=chunk,
+            )
+            parts.append({"ETag": part["ETag"], "PartNumber": part_number})
+            size += len(chunk)
+
+            chunk = await file.read(S3_UPLOAD_PART_SIZE)
+            digest.update(chunk)
+
+        await s3_client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except BaseException:
+        log.error(f"Aborting multipart upload of {key} after {len(parts)} parts")
+        try:
+            await s3_client.abort_multipart_upload(
+                Bucket=bucket, Key=key, UploadId=upload_id
+            )
+        except Exception as e:
+            log.error(f"Failed to abort multipart upload of {key}: {str(e)}")
+        raise
+
+    log.debug(f"Uploaded {key} in {len(parts)} parts ({size} bytes)")
+    return UploadedObject(key=key, size=size, sha256=digest.hexdigest())
+
+
+async def upload_files(
+    s3_client: AsyncS3Client,
+    files: List[UploadFile],
+    bucket: str,
+    keys: List[str],
+    metadata: List[Dict[str, str]],
+    concurrency: int = S3_UPLOAD_CONCURRENCY,
+) -> List[UploadedObject]:
+    """
+    Upload several files in parallel, at most `concurrency` at a time.
+
+    Results are returned in the order of `files`. If one upload fails the
+    others are cancelled (aborting their multipart uploads) and the error is
+    raised.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def upload(file: UploadFile, key: str, file_metadata: Dict[str, str]):
+        async with semaphore:
+            return await upload_file(
+                s3_client,
+                file,
+                bucket=bucket,
+                key=key,
+                content_type=file.content_type,
+                metadata=file_metadata,
+            )
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            tasks = [
+                group.create_task(upload(file, key, file_metadata))
+                for file, key, file_metadata in zip(files, keys, metadata)
+            ]
+    except BaseExceptionGroup as e:
+        # Surface the first failure like a plain await would
+        raise e.exceptions[0]
+
+    return [task.result() for task in tasks]
@@ -1,12 +1,13 @@
 import os
+import asyncio
 import asyncpg
 
 from logsim import CustomLogger
-from fastapi import Request
-from typing import AsyncGenerator, Any
+from fastapi import HTTPException, Request
+from typing import AsyncGenerator, Callable
 
-from core.s3_client import get_s3_client
-from core.database import get_db_connection
+from core.s3_client import AsyncS3Client, get_s3_client
+from core.database import DB_ACQUIRE_TIMEOUT, get_db_connection
 
 
 log = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
@@ -27,8 +28,37 @@ async def get_db() -> AsyncGenerator[asyncpg.Connection, None]:
         yield connection
 
 
-def get_s3() -> Any:
+def get_s3() -> AsyncS3Client:
     """
     Dependency to get S3 bucket client
     """
     return get_s3_client()
+
+
+def limit_concurrency(name: str, limit: int) -> Callable:
+    """
+    Build a dependency that caps how many requests run a route at once.
+
+    Requests over the cap wait up to DB_ACQUIRE_TIMEOUT seconds for a slot and
+    are then rejected with 503, so one busy route cannot take every pool
+    connection.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def dependency() -> AsyncGenerator[None, None]:
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=DB_ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning(f"Concurrency limit of {limit} reached for {name}")
+            raise HTTPException(
+                status_code=503,
+                detail=f"Too many concurrent requests for {name}",
+                headers={"Retry-After": "1"},
+            )
+
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    return dependency
@@ -3,13 +3,22 @@ from contextlib import asynccontextmanager
 
 from logsim import CustomLogger
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.cors import CORSMiddleware
 
 from middleware.logging import LoggingMiddleware
 from routers import documents, rules, templates, flow
-from core.database import init_db_pool
+from core.database import PoolExhaustedError, get_pool_stats, init_db_pool
+from core.flow_scheduler import FLOW_CALLBACK_TOKEN, FLOW_CALLBACK_URL, flow_scheduler
+from core.ingestion import ingestion_pool
+from core.notifications import pg_listener
+from core.pinazu_client import close_pinazu_client, init_pinazu_client
+from core.s3_client import close_s3_client, init_s3_client
+from core.status_writer import document_status_writer
+from core.pagination import NEXT_CURSOR_HEADER
+from core.queries import get_query_stats
+from core.responses import JSONResponse
 
 # Load environment variables from .env file
 load_dotenv()
@@ -49,7 +58,35 @@ async def lifespan(app: FastAPI):
             status_code=500,
             detail=f"Unexpected error: {e}",
         )
+
+    # Listen for cache invalidations sent by other workers
+    await pg_listener.start(
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        username=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        database=POSTGRES_DB,
+    )
+    await init_s3_client()
+    await init_pinazu_client()
+    if FLOW_CALLBACK_URL and not FLOW_CALLBACK_TOKEN:
+        log.warning(
+            "FLOW_CALLBACK_URL is set without FLOW_CALLBACK_TOKEN: status "
+            "callbacks are refused and flow runs are polled"
+        )
+    # Poll the flow runs started by this worker
+    await document_status_writer.start()
+    await flow_scheduler.start(flow.handle_flow_status)
+    # Create and execute the flows of uploaded documents
+    await ingestion_pool.start(flow.execute_flow_run, flow.monitor_flow_run)
     yield
+    # Let queued uploads reach their flow before the clients they need close
+    await ingestion_pool.stop()
+    await flow_scheduler.stop()
+    await document_status_writer.stop()
+    await pg_listener.stop()
+    await close_pinazu_client()
+    await close_s3_client()
 
 
 # Initialize FastAPI app
@@ -59,6 +96,7 @@ app = FastAPI(
     version="1.0.0",
     debug=True,
     lifespan=lifespan,
+    default_response_class=JSONResponse,
 )
 
 # Configure CORS
@@ -68,11 +106,26 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 # Configure logging middleware
 app.add_middleware(LoggingMiddleware)
 
+
+@app.exception_handler(PoolExhaustedError)
+async def pool_exhausted_handler(request: Request, exc: PoolExhaustedError):
+    """
+    Shed load with a fast 503 when no database connection is available.
+    """
+    log.warning(f"{request.method}: {request.url.path} rejected: {str(exc)}")
+    return JSONResponse(
+        content={"message": "Service is busy, please retry shortly"},
+        status_code=503,
+        headers={"Retry-After": "1"},
+    )
+
+
 # Add router
 app.include_router(prefix="/v1", router=documents.router)
 app.include_router(prefix="/v1", router=rules.router)
@@ -88,5 +141,30 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics/queries")
+async def query_metrics():
+    """
+    Call counts and p50/p95/p99 latency of every executed query.
+    """
+    return get_query_stats()
+
+
+@app.get("/metrics/pool")
+async def pool_metrics():
+    """
+    In-use, idle and waiting connection counts of the database pool.
+    """
+    return get_pool_stats()
+
+
+@app.get("/metrics/ingestion")
+async def ingestion_metrics():
+    """
+    Queued, running, completed and failed jobs of the ingestion pool, and the
+    p50/p95/p99 latency of each of its stages.
+    """
+    return ingestion_pool.stats()
+
+
 # Frontend endpoints
 app.mount("/", StaticFiles(directory="frontend", html=True), name="static")
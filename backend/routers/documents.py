@@ -1,21 +1,58 @@
 import uuid
+import asyncio
 import asyncpg
 import fastapi
-import random
 import os
-import json
-import io
-from typing import Any
 
-from datetime import datetime
+from typing import Any, Dict, List, Tuple
 from pydantic import BaseModel
 from logsim import CustomLogger
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
-
-from dependencies.main import get_db, get_request_id, get_s3
-from core.database import execute_query
-from routers.flow import create_flow, execute_flow
+from fastapi import (
+    APIRouter,
+    UploadFile,
+    File,
+    Form,
+    Header,
+    HTTPException,
+    Request,
+)
+from fastapi.responses import StreamingResponse
+
+from dependencies.main import get_db, get_request_id, get_s3, limit_concurrency
+from core.database import (
+    PoolExhaustedError,
+    execute_many,
+    execute_query,
+    get_db_connection,
+    stream_query,
+)
+from core.queries import Query, register
+from core.pagination import (
+    MAX_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    InvalidCursorError,
+    build_list_query,
+    split_page,
+)
+from core.artifacts import (
+    QUALITY_FILE_KEY,
+    RESULTS_FILE_KEY,
+    get_quality_for_file,
+    get_results_for_file,
+)
+from core.catalog_cache import catalog_cache
+from core.events import event_broadcaster, publish_document_events
+from core.flow_scheduler import PENDING_STATUS
+from core.ingestion import ingestion_pool
+from core.presign import presigned_url_cache
+from core.s3_client import AsyncS3Client, delete_keys, list_keys
+from core.responses import (
+    JSONResponse,
+    stream_json_response,
+    wants_ndjson,
+)
+from core.transaction_ids import transaction_id_allocator
+from core.uploads import upload_files
 
 # Setup logger
 logger = CustomLogger()
@@ -24,6 +61,64 @@ logger = CustomLogger()
 router = APIRouter(prefix="/documents", tags=["documents"])
 
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+# Caps on concurrent requests for the heaviest routes of this router
+MAX_CONCURRENT_DOCUMENT_LISTS = int(os.getenv("MAX_CONCURRENT_DOCUMENT_LISTS", 16))
+MAX_CONCURRENT_DOCUMENT_UPLOADS = int(os.getenv("MAX_CONCURRENT_DOCUMENT_UPLOADS", 8))
+# Upper bound of ids and transaction_ids in one bulk delete
+MAX_BULK_DELETE = int(os.getenv("MAX_BULK_DELETE", 1000))
+
+# Queries
+GET_DOCUMENT_QUERY = register(
+    "documents.get_document",
+    """
+        SELECT id, name, transaction_id, page_quality
+        FROM documents
+        WHERE id = $1
+    """,
+)
+CREATE_DOCUMENT_QUERY = register(
+    "documents.create_document",
+    """
+        INSERT INTO documents (id, name, transaction_id, template_id, status, quality, flow_id, content_sha256)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+    """,
+)
+UPDATE_DOCUMENT_QUERY = register(
+    "documents.update_document",
+    """
+        UPDATE documents
+        SET status = $1, flow_id = $2, updated_at = NOW()
+        WHERE id = $3
+        RETURNING id, flow_id, status
+    """,
+)
+DELETE_DOCUMENTS_QUERY = register(
+    "documents.delete_documents",
+    """
+        DELETE FROM documents
+        WHERE id = ANY($1) OR transaction_id = ANY($2)
+        RETURNING id, name, transaction_id, flow_id
+    """,
+)
+GET_REMAINING_TRANSACTIONS_QUERY = register(
+    "documents.get_remaining_transactions",
+    """
+        SELECT DISTINCT transaction_id
+        FROM documents
+        WHERE transaction_id = ANY($1)
+    """,
+)
+DELETE_TRANSACTION_JOBS_QUERY = register(
+    "documents.delete_transaction_jobs",
+    """
+        WITH ingestion AS (
+            DELETE FROM ingestion_jobs
+            WHERE transaction_id = ANY($1)
+        )
+        DELETE FROM flow_runs
+        WHERE transaction_id = ANY($1)
+    """,
+)
 
 
 # Model for Documents
@@ -32,28 +127,83 @@ class DocumentStatus(BaseModel):
     flow_id: str
 
 
-@router.get("")
+class BulkDeleteDocuments(BaseModel):
+    ids: list[str] = []
+    transaction_ids: list[str] = []
+
+
+@router.get(
+    "",
+    dependencies=[
+        fastapi.Depends(
+            limit_concurrency("documents.list", MAX_CONCURRENT_DOCUMENT_LISTS)
+        )
+    ],
+)
 async def get_documents(
-    conn: asyncpg.Connection = fastapi.Depends(get_db),
+    request: Request,
+    limit: int | None = fastapi.Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    status: str | None = None,
+    template_id: str | None = None,
+    transaction_id: str | None = None,
     request_id: str = fastapi.Depends(get_request_id),
 ):
-    """Get all documents or a limited number"""
+    """
+    Get documents, newest first.
+
+    With `limit` a single page is returned and the cursor of the next page is
+    sent in the X-Next-Cursor header; pass it back as `after`. Without `limit`
+    every matching document is streamed as a JSON array or NDJSON.
+    """
 
-    query = """
-        SELECT d.id, d.name, d.transaction_id, d.template_id, d.status, d.quality, d.flow_id, t.name as template_name, d.created_at
+    base_query = """
+        SELECT d.id, d.name, d.transaction_id, d.template_id, d.status, d.quality, d.flow_id, t.name as template_name, d.created_at, d.updated_at
         FROM documents d
         LEFT JOIN templates t ON d.template_id = t.id
-        ORDER BY d.updated_at DESC
     """
     try:
-        documents = await execute_query(
-            query=query,
-            params=(),
+        query, params = build_list_query(
+            base_query=base_query,
+            filters={
+                "d.status": status,
+                "d.template_id": template_id,
+                "d.transaction_id": transaction_id,
+            },
+            sort_column="d.updated_at",
+            id_column="d.id",
+            after=after,
+            limit=limit,
+        )
+
+        if limit:
+            documents = await execute_query(
+                query=Query(name="documents.list", sql=query),
+                params=params,
+                request_id=request_id,
+            )
+            documents, next_cursor = split_page(documents, limit, "updated_at")
+
+            return JSONResponse(
+                content=documents,
+                status_code=200,
+                headers={NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None,
+            )
+
+        documents = stream_query(
+            query=Query(name="documents.list", sql=query),
+            params=params,
             request_id=request_id,
-            connection=conn,
         )
 
-        return JSONResponse(content=documents, status_code=200)
+        return await stream_json_response(
+            batches=documents,
+            ndjson=wants_ndjson(request.headers.get("accept")),
+        )
+    except InvalidCursorError as e:
+        return JSONResponse(content={"message": str(e)}, status_code=400)
+    except PoolExhaustedError:
+        raise
     except Exception as e:
         return JSONResponse(
             content={"message": f"Error in getting all documents: {str(e)}"},
@@ -61,10 +211,45 @@ async def get_documents(
         )
 
 
+async def _get_page_quality(s3_client: AsyncS3Client, document: Dict) -> Any:
+    """
+    Get the page quality of a document, read from S3 only for documents whose
+    flow finished before it was stored in the database.
+    """
+    if document["page_quality"] is not None:
+        return document["page_quality"]
+    return await get_quality_for_file(
+        s3_client,
+        bucket=S3_BUCKET_NAME,
+        transaction_id=document["transaction_id"],
+        file_name=document["name"],
+    )
+
+
+@router.get("/events")
+async def get_document_events(
+    last_event_id: str | None = Header(default=None),
+):
+    """
+    Stream document status and quality transitions as Server-Sent Events.
+
+    Every message carries a list of events of type "status" (id, flow_id,
+    status), "quality" (id, flow_id, quality) or "deleted" (id, flow_id).
+    Reconnecting clients send Last-Event-ID to receive the events they
+    missed; a "reset" event means they are gone and the list should be
+    reloaded.
+    """
+    return StreamingResponse(
+        event_broadcaster.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/{id}")
 async def get_document_in_s3(
     id: str,
-    s3_client: Any = fastapi.Depends(get_s3),
+    s3_client: AsyncS3Client = fastapi.Depends(get_s3),
     conn: asyncpg.Connection = fastapi.Depends(get_db),
     request_id: str = fastapi.Depends(get_request_id),
 ):
@@ -77,12 +262,6 @@ async def get_document_in_s3(
             detail="S3 bucket name not set",
         )
 
-    get_document_query = """
-        SELECT id, name, transaction_id
-        FROM documents
-        WHERE id = $1
-    """
-
     try:
         if not id:
             logger.error("The document id is empty.")
@@ -92,7 +271,7 @@ async def get_document_in_s3(
             )
 
         document = await execute_query(
-            query=get_document_query,
+            query=GET_DOCUMENT_QUERY,
             params=(id,),
             request_id=request_id,
             connection=conn,
@@ -108,43 +287,33 @@ async def get_document_in_s3(
         raw_file_s3_key = (
             f"{document[0]['transaction_id']}/raw_file/{document[0]['name']}"
         )
-        quality_s3_key = f"{document[0]['transaction_id']}/quality_result/quality.json"
-        processed_result_s3_key = (
-            f"{document[0]['transaction_id']}/processed_results/results.json"
-        )
 
         # Get file from S3
         try:
-            # Get raw file from S3
-            raw_file = s3_client.generate_presigned_url(
-                ClientMethod="get_object",
-                Params={"Bucket": S3_BUCKET_NAME, "Key": raw_file_s3_key},
-                ExpiresIn=300,
-            )
-
-            # Get quality result from S3
-            quality_result = s3_client.get_object(
-                Bucket=S3_BUCKET_NAME, Key=quality_s3_key
-            )
-            quality_result_json = json.load(quality_result["Body"])
-            quality_result_content = quality_result_json["files"][document[0]["name"]][
-                "pages"
-            ]
-            logger.info(f"Quality result: {quality_result_content}")
-
-            # Get processed result from S3
-            processed_result = s3_client.get_object(
-                Bucket=S3_BUCKET_NAME, Key=processed_result_s3_key
-            )
-            processed_result_json = json.load(processed_result["Body"])
-            processed_result_content = next(
-                (
-                    content
-                    for content in processed_result_json
-                    if content["file_name"] == document[0]["name"]
+            # Presign the raw file, reusing a cached URL, and get the processed
+            # result of this file concurrently, from its per-file object when
+            # the flow artifacts have been split. Page quality is stored with the document once
+            # the flow succeeded, so S3 is only read for older documents.
+            (
+                raw_file,
+                quality_result_content,
+                processed_result_content,
+            ) = await asyncio.gather(
+                presigned_url_cache.get_url(
+                    s3_client,
+                    bucket=S3_BUCKET_NAME,
+                    key=raw_file_s3_key,
+                    expires_in=300,
+                ),
+                _get_page_quality(s3_client, document[0]),
+                get_results_for_file(
+                    s3_client,
+                    bucket=S3_BUCKET_NAME,
+                    transaction_id=document[0]["transaction_id"],
+                    file_name=document[0]["name"],
                 ),
-                None,
             )
+            logger.info(f"Quality result: {quality_result_content}")
 
             file_detail = {
                 "raw_file": raw_file,
@@ -157,6 +326,9 @@ async def get_document_in_s3(
 
         return JSONResponse(content=file_detail, status_code=200)
 
+    except PoolExhaustedError:
+        raise
+
     except Exception as e:
         logger.error(f"Failed to retrieve document with id {id}: {str(e)}")
         return JSONResponse(
@@ -165,16 +337,27 @@ async def get_document_in_s3(
         )
 
 
-@router.post("", status_code=201)
+@router.post(
+    "",
+    status_code=202,
+    dependencies=[
+        fastapi.Depends(
+            limit_concurrency("documents.create", MAX_CONCURRENT_DOCUMENT_UPLOADS)
+        )
+    ],
+)
 async def create_document(
     files: list[UploadFile] = File(...),
     template_ids: str = Form(...),
-    s3_client: Any = fastapi.Depends(get_s3),
-    conn: asyncpg.Connection = fastapi.Depends(get_db),
+    s3_client: AsyncS3Client = fastapi.Depends(get_s3),
     request_id: str = fastapi.Depends(get_request_id),
-    background_tasks: BackgroundTasks = BackgroundTasks(),
 ):
-    """API to create new documents"""
+    """
+    API to create new documents
+
+    The files are uploaded and the documents created as pending; their flow
+    is created and executed in the background by the ingestion pool.
+    """
 
     # Validate S3 bucket name
     if not S3_BUCKET_NAME:
@@ -183,46 +366,6 @@ async def create_document(
             detail="S3 bucket name not set",
         )
 
-    check_existing_template_id_query = """
-        SELECT id
-        FROM templates
-        WHERE id = $1
-    """
-
-    check_existing_transaction_id_query = """
-        SELECT transaction_id
-        FROM documents
-        WHERE transaction_id = $1
-    """
-
-    create_document_query = """
-        INSERT INTO documents (id, name, transaction_id, template_id, status, quality, flow_id)
-        VALUES ($1, $2, $3, $4, $5, $6, $7)
-    """
-
-    get_template_query = """
-        SELECT t.id, t.name, t.description, t.field, t.prompt, t.created_at, t.updated_at, COALESCE(
-            json_agg(
-                json_build_object(
-                    'id', r.id,
-                    'name', r.name,
-                    'description', r.description,
-                    'rule_type', r.rule_type,
-                    'condition', r.condition,
-                    'action', r.action,
-                    'created_at', r.created_at,
-                    'updated_at', r.updated_at
-                )
-            ) FILTER (WHERE r.id IS NOT NULL),
-            '[]'::json
-        ) as rule_list
-        FROM templates t
-        LEFT JOIN template_rule_mapping trm ON t.id = trm.template_id
-        LEFT JOIN rules r ON trm.rule_id = r.id
-        WHERE t.id = $1
-        GROUP BY t.id, t.name, t.description, t.field, t.prompt, t.created_at, t.updated_at
-    """
-
     try:
         template_ids_list = [tid.strip() for tid in template_ids.split(",")]
         if not files or not template_ids_list:
@@ -239,135 +382,86 @@ async def create_document(
                 detail="Number of files and template_ids must match.",
             )
 
-        for template_id in template_ids_list:
-            existing_template = await execute_query(
-                query=check_existing_template_id_query,
-                params=(template_id,),
-                request_id=request_id,
-                connection=conn,
-            )
+        # Validate every distinct template against the catalog cache
+        templates_by_id = await catalog_cache.get_templates_by_id(
+            template_ids=list(dict.fromkeys(template_ids_list)),
+            request_id=request_id,
+        )
 
-            if not existing_template:
+        for template_id in template_ids_list:
+            if template_id not in templates_by_id:
                 logger.error(f"Template with id {template_id} does not exist")
                 raise HTTPException(
                     status_code=400,
                     detail=f"Template with id {template_id} does not exist",
                 )
 
-        # Default values
-        format_date = datetime.now().strftime("%y%m")
-
-        while True:
-            transaction_number = "".join([str(random.randint(0, 9)) for _ in range(5)])
-            transaction_id = f"XDP{format_date}{transaction_number}"
-
-            # Check if transaction ID already exists
-            existing_transaction_id = await execute_query(
-                query=check_existing_transaction_id_query,
-                params=(transaction_id,),
-                request_id=request_id,
-                connection=conn,
-            )
-
-            if not existing_transaction_id:
-                # Found unique transaction ID
-                break
+        transaction_id = await transaction_id_allocator.allocate(
+            request_id=request_id,
+        )
 
-        status = "pending"
+        status = PENDING_STATUS
         quality = None
-        # Create a flow
-        flow_id = await create_flow(transaction_id)
-
-        # Determine processing type
-        if len(files) == 1:
-            processing_type = "single"
-        elif len(set(template_ids_list)) == 1:
-            processing_type = "combined"
-        else:
-            processing_type = "multiple"
-
-        # Create a template.json for the document
-        template_json = []
-
-        for i, file in enumerate(files):
-            logger.info(f"Uploading file: {file}")
-
-            # Generate a unique ID for the document
-            id = str(uuid.uuid4())
-            name = file.filename
-            template_id = template_ids_list[i]
-
-            template = await execute_query(
-                query=get_template_query,
-                params=(template_id,),
-                request_id=request_id,
-                connection=conn,
-            )
-            template[0]["rule_list"] = json.loads(template[0]["rule_list"])
-            template_json.append(template[0])
-
-            # Read file content
-            file_content = file.file.read()
-
-            # Upload file to S3 with proper metadata
-            s3_client.put_object(
-                Bucket=S3_BUCKET_NAME,
-                Key=f"{transaction_id}/raw_file/{name}",
-                Body=file_content,
-                ContentType=file.content_type or "application/octet-stream",
-                Metadata={"template_id": template_id},
-            )
+        # Document rows, inserted together once every file is uploaded
+        documents = []
+
+        # Stream every file to S3, a few at a time, hashing them on the way
+        uploaded = await upload_files(
+            s3_client,
+            files,
+            bucket=S3_BUCKET_NAME,
+            keys=[f"{transaction_id}/raw_file/{file.filename}" for file in files],
+            metadata=[{"template_id": template_id} for template_id in template_ids_list],
+        )
 
-            # Create document in database
-            await execute_query(
-                query=create_document_query,
-                params=(
-                    id,
-                    name,
+        for file, template_id, uploaded_file in zip(files, template_ids_list, uploaded):
+            logger.info(f"Uploaded file: {file.filename} ({uploaded_file.size} bytes)")
+
+            documents.append(
+                (
+                    str(uuid.uuid4()),
+                    file.filename,
                     transaction_id,
                     template_id,
                     status,
                     quality,
-                    flow_id,
-                ),
-                request_id=request_id,
-                connection=conn,
+                    None,
+                    uploaded_file.sha256,
+                )
             )
 
-        # Convert template_json to JSON string
-        template_json_string = json.dumps(template_json, indent=2, default=str)
-        # Create a file-like object in memory
-        template_file = io.BytesIO(template_json_string.encode("utf-8"))
-
-        # Upload template.json to S3
-        s3_client.put_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=f"{transaction_id}/template/template.json",
-            Body=template_file,
-            ContentType="application/json",
-            Metadata={"processing_type": processing_type},
-        )
-
-        try:
-            await execute_flow(
-                flow_id=flow_id,
-                transaction_id=transaction_id,
-                background_tasks=background_tasks,
-                conn=conn,
-                request_id=request_id,
-            )
-            logger.info(f"Successfully executed flow: {flow_id}")
-        except Exception as e:
-            logger.error(f"Failed to execute flow: {str(e)}")
+        # Create all documents and their ingestion job in one transaction,
+        # holding a connection only for that
+        async with get_db_connection() as conn:
+            async with conn.transaction():
+                await execute_many(
+                    query=CREATE_DOCUMENT_QUERY,
+                    params_list=documents,
+                    request_id=request_id,
+                    connection=conn,
+                )
+                job = await ingestion_pool.add_job(
+                    transaction_id=transaction_id,
+                    template_ids=template_ids_list,
+                    request_id=request_id,
+                    connection=conn,
+                )
+        ingestion_pool.submit(job)
 
         return JSONResponse(
-            content={"message": "Successfully created document"},
-            status_code=201,
+            content={
+                "message": "Successfully queued document",
+                "transaction_id": transaction_id,
+            },
+            status_code=202,
         )
 
     except HTTPException:
         raise
 
+    except PoolExhaustedError:
+        raise
+
     except Exception as e:
         logger.error(f"Failed to create document: {str(e)}")
         return JSONResponse(
@@ -385,12 +479,6 @@ async def update_document_status(
 ):
     """Edit a document by ID"""
 
-    update_document_query = """
-        UPDATE documents
-        SET status = $1, flow_id = $2, updated_at = NOW()
-        WHERE id = $3
-    """
-
     try:
         if not id:
             logger.error("Error in editing document: document id must not be empty")
@@ -411,18 +499,26 @@ async def update_document_status(
                 status_code=400,
             )
 
-        await execute_query(
-            query=update_document_query,
+        documents = await execute_query(
+            query=UPDATE_DOCUMENT_QUERY,
             params=(status, flow_id, id),
             request_id=request_id,
             connection=conn,
         )
+        await publish_document_events(
+            [{"type": "status", **document} for document in documents],
+            request_id=request_id,
+            connection=conn,
+        )
 
         return JSONResponse(
             content={},
             status_code=204,
         )
 
+    except PoolExhaustedError:
+        raise
+
     except Exception as e:
         logger.exception(
             f"Unexpected error occurred while editing document {id}: {str(e)}"
@@ -436,21 +532,12 @@ async def update_document_status(
 @router.delete("/{id}", status_code=204)
 async def delete_document(
     id: str,
-    s3_client: Any = fastapi.Depends(get_s3),
+    s3_client: AsyncS3Client = fastapi.Depends(get_s3),
     conn: asyncpg.Connection = fastapi.Depends(get_db),
     request_id: str = fastapi.Depends(get_request_id),
 ):
     """Delete a document by ID"""
 
-    delete_document_query = """
-        DELETE FROM documents
-        WHERE id = $1
-    """
-    check_document_query = """
-        SELECT id, transaction_id, name
-        FROM documents
-        WHERE id = $1
-    """
     try:
         if not id:
             logger.error("Error in deleting document: document id must not be empty")
@@ -461,46 +548,157 @@ async def delete_document(
                 status_code=400,
             )
 
-        # Check if document exists
-        check_document = await execute_query(
-            query=check_document_query,
-            params=(id,),
+        deleted, _ = await delete_documents(
+            ids=[id],
+            transaction_ids=[],
+            s3_client=s3_client,
+            conn=conn,
             request_id=request_id,
-            connection=conn,
         )
 
-        if not check_document:
+        if not deleted:
             logger.error(f"The document id {id} does not exist")
             return JSONResponse(
                 content={"message": f"Document with ID {id} does not exist"},
                 status_code=404,
             )
 
-        # Delete file from S3
-        s3_key = f"{check_document[0]['transaction_id']}/raw_file/{check_document[0]['name']}"
-        s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
-        logger.info(f"Successfully deleted file from S3: {s3_key}")
+        return JSONResponse(
+            content={},
+            status_code=204,
+        )
 
-        # Delete template.json from S3
-        s3_key = f"{check_document[0]['transaction_id']}/template/template.json"
-        s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
-        logger.info(f"Successfully deleted template.json from S3: {s3_key}")
+    except PoolExhaustedError:
+        raise
 
-        await execute_query(
-            query=delete_document_query,
-            params=(id,),
+    except Exception as e:
+        logger.error(f"Failed to delete document id {id}: {str(e)}")
+        return JSONResponse(
+            content={"message": f"Failed to delete document id {id}"},
+            status_code=500,
+        )
+
+
+@router.post("/bulk-delete")
+async def bulk_delete_documents(
+    request: BulkDeleteDocuments,
+    s3_client: AsyncS3Client = fastapi.Depends(get_s3),
+    conn: asyncpg.Connection = fastapi.Depends(get_db),
+    request_id: str = fastapi.Depends(get_request_id),
+):
+    """Delete many documents by ID and/or every document of some transactions"""
+
+    if not request.ids and not request.transaction_ids:
+        return JSONResponse(
+            content={"message": "ids or transaction_ids are required."},
+            status_code=400,
+        )
+
+    if len(request.ids) + len(request.transaction_ids) > MAX_BULK_DELETE:
+        return JSONResponse(
+            content={
+                "message": f"At most {MAX_BULK_DELETE} ids and transaction_ids per request."
+            },
+            status_code=400,
+        )
+
+    try:
+        deleted, failed_keys = await delete_documents(
+            ids=request.ids,
+            transaction_ids=request.transaction_ids,
+            s3_client=s3_client,
+            conn=conn,
             request_id=request_id,
-            connection=conn,
         )
 
         return JSONResponse(
-            content={},
-            status_code=204,
+            content={
+                "deleted": [document["id"] for document in deleted],
+                "failed_keys": failed_keys,
+            },
+            status_code=200,
         )
 
+    except PoolExhaustedError:
+        raise
+
     except Exception as e:
-        logger.error(f"Failed to delete document id {id}: {str(e)}")
+        logger.error(f"Failed to delete documents: {str(e)}")
         return JSONResponse(
-            content={"message": f"Failed to delete document id {id}"},
+            content={"message": f"Failed to delete documents: {str(e)}"},
             status_code=500,
         )
+
+
+async def delete_documents(
+    ids: List[str],
+    transaction_ids: List[str],
+    s3_client: AsyncS3Client,
+    conn: asyncpg.Connection,
+    request_id: str,
+) -> Tuple[List[Dict], List[str]]:
+    """
+    Delete documents and their S3 objects.
+
+    Rows are deleted in one statement. Transactions left without documents
+    lose every object under their prefix (raw files, template, flow
+    artifacts), their flow runs and their ingestion job; for the others only the deleted files'
+    raw file and per-file artifacts are removed. Keys are deleted in
+    concurrent DeleteObjects batches. Returns the deleted rows and the keys
+    S3 failed to delete.
+    """
+    async with conn.transaction():
+        deleted = await execute_query(
+            query=DELETE_DOCUMENTS_QUERY,
+            params=(ids, transaction_ids),
+            request_id=request_id,
+            connection=conn,
+        )
+        affected = list({document["transaction_id"] for document in deleted})
+        remaining = await execute_query(
+            query=GET_REMAINING_TRANSACTIONS_QUERY,
+            params=(affected,),
+            request_id=request_id,
+            connection=conn,
+        )
+        remaining = {row["transaction_id"] for row in remaining}
+        emptied = [tid for tid in affected if tid not in remaining]
+        await execute_query(
+            query=DELETE_TRANSACTION_JOBS_QUERY,
+            params=(emptied,),
+            request_id=request_id,
+            connection=conn,
+        )
+
+    if not deleted:
+        return deleted, []
+
+    # Every object of emptied transactions, only the files' own objects otherwise
+    prefix_keys = await asyncio.gather(
+        *(list_keys(s3_client, S3_BUCKET_NAME, f"{tid}/") for tid in emptied)
+    )
+    keys = [key for transaction_keys in prefix_keys for key in transaction_keys]
+    for document in deleted:
+        if document["transaction_id"] in remaining:
+            tid, name = document["transaction_id"], document["name"]
+            keys.append(f"{tid}/raw_file/{name}")
+            keys.append(QUALITY_FILE_KEY.format(transaction_id=tid, file_name=name))
+            keys.append(RESULTS_FILE_KEY.format(transaction_id=tid, file_name=name))
+
+    errors = await delete_keys(s3_client, S3_BUCKET_NAME, keys)
+    failed_keys = [error["Key"] for error in errors]
+    for error in errors:
+        logger.error(f"Failed to delete {error['Key']} from S3: {error.get('Message')}")
+    logger.info(
+        f"Deleted {len(deleted)} documents and {len(keys) - len(errors)} S3 objects"
+    )
+
+    await publish_document_events(
+        [
+            {"type": "deleted", "id": document["id"], "flow_id": document["flow_id"]}
+            for document in deleted
+        ],
+        request_id=request_id,
+        connection=conn,
+    )
+    return deleted, failed_keys
@@ -1,17 +1,40 @@
-import requests
 import os
+import hmac
 import asyncpg
-import asyncio
 import fastapi
-import json
 
+from typing import Dict
 from logsim import CustomLogger
-from fastapi import APIRouter, BackgroundTasks
-from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import Response
 
 from dependencies.main import get_db, get_request_id
-from core.database import execute_query
+from core.artifacts import (
+    QUALITY_KEY,
+    artifact_cache,
+    index_quality,
+    split_flow_artifacts,
+)
+from core.database import PoolExhaustedError, execute_query
+from core.events import publish_document_events
+from core.flow_scheduler import (
+    FLOW_CALLBACK_TOKEN,
+    FLOW_CALLBACK_URL,
+    FLOW_CALLBACKS_ENABLED,
+    SUCCESS_STATUS,
+    TERMINAL_STATUSES,
+    FlowRun,
+    complete_flow_run,
+    flow_scheduler,
+    notify_flow_status,
+)
+from core.pinazu_client import get_pinazu_client
+from core.quality import grade_files
+from core.queries import register
+from core.responses import JSONResponse, encode_json
 from core.s3_client import get_s3_client
+from core.status_writer import document_status_writer
 
 # Setup logger
 logger = CustomLogger()
@@ -20,210 +43,273 @@ logger = CustomLogger()
 router = APIRouter(prefix="/flow", tags=["flow"])
 
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
-TIME_TO_MONITOR_FLOW = int(os.getenv("TIME_TO_MONITOR_FLOW", 5))
 
-active_monitoring_tasks: dict[str, asyncio.Task] = {}
+# Header carrying FLOW_CALLBACK_TOKEN on status callbacks
+FLOW_CALLBACK_TOKEN_HEADER = "X-Flow-Callback-Token"
 
+# Queries
+GET_FLOW_TRANSACTION_QUERY = register(
+    "flow.get_flow_transaction",
+    """
+        SELECT transaction_id
+        FROM documents
+        WHERE flow_id = $1
+        LIMIT 1
+    """,
+)
+UPDATE_DOCUMENT_STATUS_QUERY = register(
+    "flow.update_document_status",
+    """
+        UPDATE documents
+        SET status = $1, updated_at = NOW()
+        WHERE flow_id = $2 AND status IS DISTINCT FROM $1
+        RETURNING id, flow_id, status
+    """,
+)
+UPDATE_DOCUMENT_QUALITY_QUERY = register(
+    "flow.update_document_quality",
+    """
+        UPDATE documents d
+        SET quality = u.quality, page_quality = u.page_quality::jsonb, updated_at = NOW()
+        FROM unnest($2::text[], $3::text[], $4::text[]) AS u(name, quality, page_quality)
+        WHERE d.flow_id = $1 AND d.name = u.name
+        RETURNING d.id, d.flow_id, d.quality
+    """,
+)
 
-async def create_flow(transaction_id: str) -> str | None:
-    """Create a flow"""
-    try:
-        response = requests.post(
-            "http://pinazu:8081/v1/flows",
-            json={
-                "name": transaction_id,
-                "parameters_schema": {
-                    "job_id": transaction_id,
-                },
-                "engine": "process",
-                "code_location": "s3://test-bucket-302010997939-ap-southeast-1/flows/mb-idp.py",
-                "entrypoint": "python",
-                "tags": ["mb", "idp"],
-            },
-            timeout=30,
-        )
-        flow_response = response.json()
-        if flow_response.get("id"):
-            return flow_response.get("id")
-        else:
-            logger.error(f"Failed to create flow: {flow_response}")
-            return None
-    except Exception as e:
-        logger.error(f"Failed to create flow: {str(e)}")
+
+# Model for status callbacks
+class FlowStatusCallback(BaseModel):
+    flow_run_id: str
+    status: str
 
 
 @router.post("/{flow_id}/execute", status_code=204)
 async def execute_flow(
     flow_id: str,
     transaction_id: str,
-    background_tasks: BackgroundTasks,
     conn: asyncpg.Connection = fastapi.Depends(get_db),
     request_id: str = fastapi.Depends(get_request_id),
 ):
     """Execute a flow"""
 
-    update_document_status_query = """
-        UPDATE documents
-        SET status = $1, updated_at = NOW()
-        WHERE flow_id = $2
-    """
-
     try:
-        response = requests.post(
-            f"http://pinazu:8081/v1/flows/{flow_id}/execute",
-            json={
-                "parameters": {
-                    "job_id": transaction_id,
-                },
-            },
-            timeout=30,
-        )
-        execute_flow_info = response.json()
-        logger.info(f"Execute flow info: {execute_flow_info}")
-        await execute_query(
-            query=update_document_status_query,
-            params=(execute_flow_info.get("status"), flow_id),
+        await start_flow_run(
+            flow_id=flow_id,
+            transaction_id=transaction_id,
             request_id=request_id,
             connection=conn,
         )
+        return Response(status_code=204)
+    except PoolExhaustedError:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to execute flow: {str(e)}")
+        return JSONResponse(
+            content={"message": f"Failed to execute flow: {str(e)}"},
+            status_code=500,
+        )
 
-        flow_run_id = execute_flow_info.get("flow_run_id")
 
-        if flow_run_id:
-            # Create and start the background monitoring task
-            background_tasks.add_task(
-                monitor_flow_status_background,
-                flow_id,
-                flow_run_id,
-                request_id,
-                transaction_id,
+async def start_flow_run(
+    flow_id: str,
+    transaction_id: str,
+    request_id: str = None,
+    connection: asyncpg.Connection = None,
+):
+    """Execute a flow and start monitoring its run"""
+    execute_flow_info = await execute_flow_run(flow_id, transaction_id)
+    await monitor_flow_run(
+        flow_id=flow_id,
+        flow_run_id=execute_flow_info.get("flow_run_id"),
+        transaction_id=transaction_id,
+        status=execute_flow_info.get("status"),
+        request_id=request_id,
+        connection=connection,
+    )
+
+
+async def execute_flow_run(flow_id: str, transaction_id: str) -> Dict:
+    """Ask the flow service to execute a flow"""
+    execute_flow_info = await get_pinazu_client().execute_flow(
+        flow_id,
+        transaction_id,
+        callback_url=(
+            f"{FLOW_CALLBACK_URL}/v1/flow/{flow_id}/callback"
+            if FLOW_CALLBACKS_ENABLED
+            else None
+        ),
+    )
+    logger.info(f"Execute flow info: {execute_flow_info}")
+    return execute_flow_info
+
+
+async def monitor_flow_run(
+    flow_id: str,
+    flow_run_id: str | None,
+    transaction_id: str,
+    status: str | None,
+    request_id: str = None,
+    connection: asyncpg.Connection = None,
+):
+    """Record the status of an executed flow and start monitoring its run"""
+    documents = await execute_query(
+        query=UPDATE_DOCUMENT_STATUS_QUERY,
+        params=(status, flow_id),
+        request_id=request_id,
+        connection=connection,
+    )
+    await publish_document_events(
+        [{"type": "status", **document} for document in documents],
+        request_id=request_id,
+        connection=connection,
+    )
+
+    if flow_run_id:
+        await flow_scheduler.add_run(
+            flow_id=flow_id,
+            flow_run_id=flow_run_id,
+            transaction_id=transaction_id,
+            request_id=request_id,
+            status=status,
+            connection=connection,
+        )
+    else:
+        logger.warning("No flow_run_id received, skipping monitoring")
+
+
+def verify_callback_token(
+    callback_token: str | None = Header(default=None, alias=FLOW_CALLBACK_TOKEN_HEADER),
+):
+    """Reject callbacks without the shared token, before touching the database"""
+    # Callbacks are refused unless a token is configured to check them against
+    if not FLOW_CALLBACK_TOKEN:
+        raise HTTPException(status_code=403, detail="Flow callbacks are disabled")
+    if not hmac.compare_digest(callback_token or "", FLOW_CALLBACK_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid callback token")
+
+
+@router.post(
+    "/{flow_id}/callback",
+    status_code=204,
+    dependencies=[fastapi.Depends(verify_callback_token)],
+)
+async def flow_status_callback(
+    flow_id: str,
+    request: FlowStatusCallback,
+    conn: asyncpg.Connection = fastapi.Depends(get_db),
+    request_id: str = fastapi.Depends(get_request_id),
+):
+    """Receive a flow run status transition from the flow service"""
+
+    try:
+        flow = await execute_query(
+            query=GET_FLOW_TRANSACTION_QUERY,
+            params=(flow_id,),
+            request_id=request_id,
+            connection=conn,
+        )
+        if not flow:
+            logger.error(f"Callback for unknown flow {flow_id}")
+            return JSONResponse(
+                content={"message": f"Flow with ID {flow_id} does not exist"},
+                status_code=404,
             )
 
-            logger.info(f"Started background monitoring for flow run: {flow_run_id}")
-        else:
-            logger.warning("No flow_run_id received, skipping background monitoring")
+        logger.info(f"Flow {request.flow_run_id} status callback: {request.status}")
+        run = FlowRun(
+            flow_id=flow_id,
+            flow_run_id=request.flow_run_id,
+            transaction_id=flow[0]["transaction_id"],
+            request_id=request_id,
+        )
+        await handle_flow_status(run, request.status)
+
+        # Stop or postpone polling of the run in whichever worker tracks it
+        await notify_flow_status(
+            flow_run_id=request.flow_run_id,
+            status=request.status,
+            request_id=request_id,
+            connection=conn,
+        )
 
         return Response(status_code=204)
+    except PoolExhaustedError:
+        raise
     except Exception as e:
-        logger.error(f"Failed to execute flow: {str(e)}")
+        logger.error(f"Failed to handle flow callback: {str(e)}")
         return JSONResponse(
-            content={"message": f"Failed to execute flow: {str(e)}"},
+            content={"message": f"Failed to handle flow callback: {str(e)}"},
             status_code=500,
         )
 
 
-async def monitor_flow_status_background(
-    flow_id: str, flow_run_id: str, request_id: str, transaction_id: str
-):
+async def handle_flow_status(run: FlowRun, status: str):
     """
-    Background task to monitor flow status every specific seconds
-    until status becomes 'failed' or 'success'
+    Store the status polled by the flow scheduler and process the results of
+    runs that succeeded.
     """
+    # Terminal statuses are written before the run is completed, so they
+    # can not be lost with the batch; the others only when they changed
+    if status and status.upper() in TERMINAL_STATUSES:
+        await document_status_writer.write(run.flow_id, status, run.request_id)
+        # A callback and a poll can both see the end of a run; only the one
+        # completing it processes the results, and only if it succeeded
+        completed = await complete_flow_run(run, status, run.request_id)
+        if completed and status.upper() == SUCCESS_STATUS:
+            await process_flow_results(
+                run.flow_id, run.transaction_id, run.request_id
+            )
+    elif status != run.status:
+        document_status_writer.submit(run.flow_id, status)
 
-    update_document_status_query = """
-        UPDATE documents
-        SET status = $1, updated_at = NOW()
-        WHERE flow_id = $2
-    """
 
-    update_document_quality_query = """
-        UPDATE documents
-        SET quality = $1, updated_at = NOW()
-        WHERE flow_id = $2 AND name = $3
+async def process_flow_results(flow_id: str, transaction_id: str, request_id: str):
+    """
+    Update document quality and page metrics from the flow's quality.json
+    and split its artifacts into per-file objects for single-document readers.
     """
+    s3_client = get_s3_client()
 
     try:
-        while True:
-            try:
-                response = requests.get(
-                    f"http://pinazu:8081/v1/flows/{flow_run_id}/status",
-                    timeout=30,
-                )
-
-                if response.status_code == 200:
-                    status_data = response.json()
-                    current_status = status_data.get("status")
-
-                    logger.info(f"Flow {flow_run_id} status: {current_status}")
-
-                    # Update document status in database
-                    await execute_query(
-                        query=update_document_status_query,
-                        params=(current_status, flow_id),
-                        request_id=request_id,
-                    )
-
-                    # Check if flow is completed (failed or success)
-                    if current_status.upper() in ["FAILED", "SUCCESS"]:
-                        logger.info(
-                            f"Flow {flow_run_id} completed with status: {current_status}"
-                        )
-
-                        # Only try to update quality if the flow was successful
-                        if current_status.upper() == "SUCCESS":
-                            try:
-                                # Update document quality in database
-                                quality_s3_key = (
-                                    f"{transaction_id}/quality_result/quality.json"
-                                )
-                                quality_file = get_s3_client().get_object(
-                                    Bucket=S3_BUCKET_NAME,
-                                    Key=quality_s3_key,
-                                )
-                                quality_result_json = json.load(quality_file["Body"])
-                                quality_result_content = quality_result_json["files"]
-                                for (
-                                    file_key,
-                                    file_value,
-                                ) in quality_result_content.items():
-                                    pages = file_value["pages"]
-                                    overall_quality = 0
-                                    for page in pages:
-                                        overall_quality += page["quality_metrics"][
-                                            "overall_quality"
-                                        ]
-                                    overall_quality = overall_quality / len(pages)
-
-                                    if overall_quality > 80:
-                                        quality = "good"
-                                    elif overall_quality > 60:
-                                        quality = "fair"
-                                    else:
-                                        quality = "poor"
-
-                                    logger.info(f"Overall quality: {overall_quality}")
-                                    logger.info(f"File key: {file_key}")
-                                    await execute_query(
-                                        query=update_document_quality_query,
-                                        params=(quality, flow_id, file_key),
-                                        request_id=request_id,
-                                    )
-                            except Exception as e:
-                                logger.error(
-                                    f"Error processing quality results: {str(e)}"
-                                )
-                        break
-
-                    # Wait before next check
-                    await asyncio.sleep(TIME_TO_MONITOR_FLOW)
-
-                else:
-                    logger.error(
-                        f"Failed to get flow status. Status code: {response.status_code}"
-                    )
-                    await asyncio.sleep(TIME_TO_MONITOR_FLOW)
-
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Request error monitoring flow {flow_run_id}: {str(e)}")
-                await asyncio.sleep(TIME_TO_MONITOR_FLOW)
-            except Exception as e:
-                logger.error(f"Error monitoring flow {flow_run_id}: {str(e)}")
-                await asyncio.sleep(TIME_TO_MONITOR_FLOW)
+        # Update document quality and page metrics in database
+        quality_artifact = await artifact_cache.get(
+            s3_client,
+            bucket=S3_BUCKET_NAME,
+            key=QUALITY_KEY.format(transaction_id=transaction_id),
+            index=index_quality,
+        )
+        names, grades, averages = grade_files(quality_artifact.files)
+        logger.info(
+            f"Graded {len(names)} files of {transaction_id}, "
+            f"average quality {averages.mean() if len(names) else 0:.1f}"
+        )
+        # Grades and page metrics of every file in one statement. Page
+        # metrics are bound as JSON text, since asyncpg would read each file's
+        # list of pages as another array dimension
+        documents = await execute_query(
+            query=UPDATE_DOCUMENT_QUALITY_QUERY,
+            params=(
+                flow_id,
+                names,
+                grades,
+                [encode_json(quality_artifact.files[name]).decode() for name in names],
+            ),
+            request_id=request_id,
+        )
+        await publish_document_events(
+            [{"type": "quality", **document} for document in documents],
+            request_id=request_id,
+        )
+    except Exception as e:
+        logger.error(f"Error processing quality results: {str(e)}")
 
+    try:
+        # Reuses the artifacts parsed above, so this only costs the writes
+        await split_flow_artifacts(
+            s3_client,
+            bucket=S3_BUCKET_NAME,
+            transaction_id=transaction_id,
+        )
     except Exception as e:
-        logger.error(f"Fatal error in flow monitoring for {flow_run_id}: {str(e)}")
-    finally:
-        # Clean up monitoring task
-        if flow_run_id in active_monitoring_tasks:
-            del active_monitoring_tasks[flow_run_id]
-        logger.info(f"Stopped monitoring flow {flow_run_id}")
+        logger.error(f"Failed to split artifacts of {transaction_id}: {str(e)}")
@@ -2,20 +2,87 @@ import uuid
 import asyncpg
 import fastapi
 import os
-import json
 
 from logsim import CustomLogger
 from fastapi import APIRouter
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import Response
 from pydantic import BaseModel
 
 from dependencies.main import get_db, get_request_id
-from core.database import execute_query
+from core.database import PoolExhaustedError, execute_query
+from core.queries import register
+from core.responses import JSONResponse
+from core.catalog_cache import catalog_cache, notify_catalog_changed
+from core.pagination import (
+    MAX_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    InvalidCursorError,
+    paginate_rows,
+)
 
 # Setup router for rules
 router = APIRouter(prefix="/rules", tags=["rules"])
 logger = CustomLogger(use_json=os.getenv("LOG_FORMAT_JSON") == "true")
 
+# Queries
+CREATE_RULE_QUERY = register(
+    "rules.create_rule",
+    """
+        INSERT INTO rules (id, name, description, rule_type, condition, action)
+        VALUES ($1, $2, $3, $4, $5, $6)
+    """,
+)
+CHECK_EXISTING_RULE_QUERY = register(
+    "rules.check_existing_rule",
+    """
+        SELECT id
+        FROM rules
+        WHERE name = $1
+    """,
+)
+UPDATE_RULE_QUERY = register(
+    "rules.update_rule",
+    """
+        UPDATE rules
+        SET name = $1, description = $2, rule_type = $3, condition = $4, action = $5
+        WHERE id = $6
+    """,
+)
+CHECK_EXISTING_RULE_NAME_QUERY = register(
+    "rules.check_existing_rule_name",
+    """
+        SELECT id
+        FROM rules
+        WHERE name = $1 AND id != $2
+    """,
+)
+CHECK_EXISTING_RULE_ID_QUERY = register(
+    "rules.check_existing_rule_id",
+    """
+        SELECT id
+        FROM rules
+        WHERE id = $1
+    """,
+)
+CHECK_RULE_QUERY = register(
+    "rules.check_rule",
+    """
+        SELECT id, name FROM rules WHERE id = $1
+    """,
+)
+DELETE_MAPPING_QUERY = register(
+    "rules.delete_mapping",
+    """
+        DELETE FROM template_rule_mapping WHERE rule_id = $1
+    """,
+)
+DELETE_RULE_QUERY = register(
+    "rules.delete_rule",
+    """
+        DELETE FROM rules WHERE id = $1
+    """,
+)
+
 
 # Model for Request Rules
 class Rules(BaseModel):
@@ -28,44 +95,39 @@ class Rules(BaseModel):
 
 @router.get("")
 async def get_rules(
-    conn: asyncpg.Connection = fastapi.Depends(get_db),
+    limit: int | None = fastapi.Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    rule_type: str | None = None,
     request_id: str = fastapi.Depends(get_request_id),
 ):
-    """Get all available rules in the system"""
-    # Get all rules from database
-    query = """
-        SELECT id, name, description, rule_type, condition, action, created_at, updated_at
-        FROM rules
-        ORDER BY created_at DESC
+    """
+    Get available rules in the system, newest first.
+
+    With `limit` a single page is returned and the cursor of the next page is
+    sent in the X-Next-Cursor header; pass it back as `after`.
     """
     try:
-        rules = await execute_query(
-            query=query,
-            params=(),
-            request_id=request_id,
-            connection=conn,
+        # Get rules from the catalog cache
+        rules = await catalog_cache.get_rules(request_id=request_id)
+        if rule_type:
+            rules = [rule for rule in rules if rule["rule_type"] == rule_type]
+
+        rules, next_cursor = paginate_rows(
+            rows=rules,
+            sort_key="created_at",
+            after=after,
+            limit=limit,
         )
 
-        for rule in rules:
-            if (
-                rule.get("condition")
-                and isinstance(rule["condition"], str)
-                and rule.get("action")
-                and isinstance(rule["action"], str)
-            ):
-                try:
-                    rule["condition"] = json.loads(rule["condition"])
-                    rule["action"] = json.loads(rule["action"])
-                except json.JSONDecodeError:
-                    # If parsing fails, keep the original string
-                    logger.warning(
-                        f"Failed to parse condition for rule {rule.get('id')}: {rule['condition']}"
-                    )
-
         return JSONResponse(
             content=rules,
             status_code=200,
+            headers={NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None,
         )
+    except InvalidCursorError as e:
+        return JSONResponse(content={"message": str(e)}, status_code=400)
+    except PoolExhaustedError:
+        raise
     except Exception as e:
         logger.exception(f"Error getting rules: {e}")
         return JSONResponse(
@@ -85,17 +147,6 @@ async def create_rule(
     # Create rule id
     id = str(uuid.uuid4())
 
-    create_rule_query = """
-        INSERT INTO rules (id, name, description, rule_type, condition, action)
-        VALUES ($1, $2, $3, $4, $5, $6)
-    """
-
-    check_existing_rule_query = """
-        SELECT id
-        FROM rules
-        WHERE name = $1
-    """
-
     try:
         # Validate required fields
         name = request.name
@@ -113,7 +164,7 @@ async def create_rule(
 
         # Check if rule name already exists in database
         existing_rule = await execute_query(
-            query=check_existing_rule_query,
+            query=CHECK_EXISTING_RULE_QUERY,
             params=(name,),
             request_id=request_id,
             connection=conn,
@@ -131,20 +182,25 @@ async def create_rule(
             name,
             description,
             rule_type,
-            json.dumps(condition),
-            json.dumps(action),
+            condition,
+            action,
         )
         await execute_query(
-            query=create_rule_query,
+            query=CREATE_RULE_QUERY,
             params=params,
             request_id=request_id,
             connection=conn,
         )
 
+        # Invalidate cached templates and rules in every worker
+        await notify_catalog_changed(request_id=request_id, connection=conn)
+
         return JSONResponse(
             content={"message": f"Successfully created rule {name}"},
             status_code=201,
         )
+    except PoolExhaustedError:
+        raise
     except Exception as e:
         logger.exception(f"Error creating rule: {e}")
         return JSONResponse(
@@ -162,24 +218,6 @@ async def update_rule(
 ):
     """Update an existing rule"""
 
-    update_rule_query = """
-        UPDATE rules
-        SET name = $1, description = $2, rule_type = $3, condition = $4, action = $5
-        WHERE id = $6
-    """
-
-    check_existing_rule_name_query = """
-        SELECT id
-        FROM rules
-        WHERE name = $1 AND id != $2
-    """
-
-    check_existing_rule_id_query = """
-        SELECT id
-        FROM rules
-        WHERE id = $1
-    """
-
     # Read the JSON body
     try:
         if not id:
@@ -191,7 +229,7 @@ async def update_rule(
 
         # Check if rule exists in database
         existing_rule = await execute_query(
-            query=check_existing_rule_id_query,
+            query=CHECK_EXISTING_RULE_ID_QUERY,
             params=(id,),
             request_id=request_id,
             connection=conn,
@@ -218,7 +256,7 @@ async def update_rule(
 
         # Check if rule name already exists in database
         check_existing_rule_name = await execute_query(
-            query=check_existing_rule_name_query,
+            query=CHECK_EXISTING_RULE_NAME_QUERY,
             params=(name, id),
             request_id=request_id,
             connection=conn,
@@ -232,20 +270,25 @@ async def update_rule(
             )
 
         await execute_query(
-            query=update_rule_query,
+            query=UPDATE_RULE_QUERY,
             params=(
                 name,
                 description,
                 rule_type,
-                json.dumps(condition),
-                json.dumps(action),
+                condition,
+                action,
                 id,
             ),
             request_id=request_id,
             connection=conn,
         )
 
+        # Invalidate cached templates and rules in every worker
+        await notify_catalog_changed(request_id=request_id, connection=conn)
+
         return Response(status_code=204)
+    except PoolExhaustedError:
+        raise
     except Exception as e:
         logger.exception(f"Error updating rule: {e}")
         return JSONResponse(
@@ -263,22 +306,10 @@ async def delete_rule(
     """Delete a custom rule and all related mappings"""
 
     # First check if rule exists
-    check_rule_query = """
-        SELECT id, name FROM rules WHERE id = $1
-    """
-
-    delete_mapping_query = """
-        DELETE FROM template_rule_mapping WHERE rule_id = $1
-    """
-
-    delete_rule_query = """
-        DELETE FROM rules WHERE id = $1
-    """
-
     try:
         # Check if rule exists
         existing_rule = await execute_query(
-            query=check_rule_query,
+            query=CHECK_RULE_QUERY,
             params=(id,),
             request_id=request_id,
             connection=conn,
@@ -292,7 +323,7 @@ async def delete_rule(
 
         # Then delete the rule in rules table
         await execute_query(
-            query=delete_rule_query,
+            query=DELETE_RULE_QUERY,
             params=(id,),
             request_id=request_id,
             connection=conn,
@@ -300,13 +331,18 @@ async def delete_rule(
 
         # Delete related mappings in template_rule_mapping table
         await execute_query(
-            query=delete_mapping_query,
+            query=DELETE_MAPPING_QUERY,
             params=(id,),
             request_id=request_id,
             connection=conn,
         )
 
+        # Invalidate cached templates and rules in every worker
+        await notify_catalog_changed(request_id=request_id, connection=conn)
+
         return Response(status_code=204)
+    except PoolExhaustedError:
+        raise
     except Exception as e:
         logger.exception(f"Error deleting rule: {e}")
         return JSONResponse(
@@ -1,15 +1,23 @@
 import uuid
 import asyncpg
 import fastapi
-import json
 
 from pydantic import BaseModel
 from logsim import CustomLogger
 from fastapi import APIRouter
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import Response
 
 from dependencies.main import get_db, get_request_id
-from core.database import execute_query
+from core.database import PoolExhaustedError, execute_query
+from core.queries import register
+from core.responses import JSONResponse
+from core.catalog_cache import catalog_cache, notify_catalog_changed
+from core.pagination import (
+    MAX_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    InvalidCursorError,
+    paginate_rows,
+)
 
 # Setup logger
 logger = CustomLogger()
@@ -17,6 +25,78 @@ logger = CustomLogger()
 # Setup router
 router = APIRouter(prefix="/templates", tags=["templates"])
 
+# Queries
+CREATE_TEMPLATE_QUERY = register(
+    "templates.create_template",
+    """
+        INSERT INTO templates (id, name, description, field, prompt)
+        VALUES ($1, $2, $3, $4, $5)
+    """,
+)
+ADD_TEMPLATE_RULE_MAPPINGS_QUERY = register(
+    "templates.add_template_rule_mappings",
+    """
+        INSERT INTO template_rule_mapping (template_id, rule_id)
+        SELECT $1, id
+        FROM rules
+        WHERE id = ANY($2)
+        ON CONFLICT (template_id, rule_id) DO NOTHING
+    """,
+)
+DELETE_STALE_TEMPLATE_RULE_MAPPINGS_QUERY = register(
+    "templates.delete_stale_template_rule_mappings",
+    """
+        DELETE FROM template_rule_mapping
+        WHERE template_id = $1 AND NOT (rule_id = ANY($2))
+    """,
+)
+CHECK_EXISTING_TEMPLATE_NAME_QUERY = register(
+    "templates.check_existing_template_name",
+    """
+        SELECT id
+        FROM templates
+        WHERE name = $1
+    """,
+)
+UPDATE_TEMPLATE_QUERY = register(
+    "templates.update_template",
+    """
+        UPDATE templates
+        SET name = $1, description = $2, field = $3, prompt = $4
+        WHERE id = $5
+    """,
+)
+CHECK_DUPLICATE_TEMPLATE_NAME_QUERY = register(
+    "templates.check_duplicate_template_name",
+    """
+        SELECT name
+        FROM templates
+        WHERE name = $1 AND id != $2
+    """,
+)
+CHECK_EXISTING_TEMPLATE_ID_QUERY = register(
+    "templates.check_existing_template_id",
+    """
+        SELECT id
+        FROM templates
+        WHERE id = $1
+    """,
+)
+DELETE_TEMPLATE_QUERY = register(
+    "templates.delete_template",
+    """
+        DELETE FROM templates
+        WHERE id = $1
+    """,
+)
+DELETE_TEMPLATE_RULE_MAPPING_QUERY = register(
+    "templates.delete_template_rule_mapping",
+    """
+        DELETE FROM template_rule_mapping
+        WHERE template_id = $1
+    """,
+)
+
 
 # Model for Request Templates
 class Templates(BaseModel):
@@ -29,41 +109,38 @@ class Templates(BaseModel):
 
 @router.get("")
 async def get_templates(
-    conn: asyncpg.Connection = fastapi.Depends(get_db),
+    limit: int | None = fastapi.Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
     request_id: str = fastapi.Depends(get_request_id),
 ):
-    """Get all templates or a limited number"""
-
-    query = """
-        SELECT t.id, t.name, t.description, t.field, t.prompt, t.created_at, t.updated_at, COALESCE(
-            json_agg(trm.rule_id) FILTER (WHERE trm.rule_id IS NOT NULL),
-            '[]'::json
-        ) as rule_ids
-        FROM templates t
-        LEFT JOIN template_rule_mapping trm ON t.id = trm.template_id
-        GROUP BY t.id, t.name, t.description, t.field, t.prompt, t.created_at, t.updated_at
-        ORDER BY t.created_at DESC
+    """
+    Get all templates or a limited number, newest first.
+
+    With `limit` a single page is returned and the cursor of the next page is
+    sent in the X-Next-Cursor header; pass it back as `after`.
     """
     try:
-        templates = await execute_query(
-            query=query,
-            params=(),
-            request_id=request_id,
-            connection=conn,
+        # Get templates from the catalog cache
+        templates = await catalog_cache.get_templates(request_id=request_id)
+
+        templates, next_cursor = paginate_rows(
+            rows=templates,
+            sort_key="created_at",
+            after=after,
+            limit=limit,
         )
-
         for template in templates:
-            if template.get("field") and isinstance(template["field"], str):
-                try:
-                    template["field"] = json.loads(template["field"])
-                    template["rule_ids"] = json.loads(template["rule_ids"])
-                except json.JSONDecodeError:
-                    # If parsing fails, keep the original string
-                    logger.warning(
-                        f"Failed to parse field for template {template.get('id')}: {template['field']}"
-                    )
-
-        return JSONResponse(content=templates, status_code=200)
+            template.pop("rule_list", None)
+
+        return JSONResponse(
+            content=templates,
+            status_code=200,
+            headers={NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None,
+        )
+    except InvalidCursorError as e:
+        return JSONResponse(content={"message": str(e)}, status_code=400)
+    except PoolExhaustedError:
+        raise
     except Exception as e:
         return JSONResponse(
             content={"message": f"Error in getting all templates: {str(e)}"},
@@ -74,20 +151,9 @@ async def get_templates(
 @router.get("/{id}")
 async def get_template_by_id(
     id: str,
-    conn: asyncpg.Connection = fastapi.Depends(get_db),
     request_id: str = fastapi.Depends(get_request_id),
 ):
     """Get a specific template by ID"""
-    get_template_query = """
-        SELECT t.id, t.name, t.description, t.field, t.prompt, t.created_at, t.updated_at, COALESCE(
-            json_agg(trm.rule_id) FILTER (WHERE trm.rule_id IS NOT NULL),
-            '[]'::json
-        ) as rule_ids
-        FROM templates t
-        LEFT JOIN template_rule_mapping trm ON t.id = trm.template_id
-        WHERE t.id = $1
-        GROUP BY t.id, t.name, t.description, t.field, t.prompt, t.created_at, t.updated_at
-    """
     try:
         if not id:
             logger.error("The template id is empty.")
@@ -96,21 +162,25 @@ async def get_template_by_id(
                 status_code=400,
             )
 
-        template = await execute_query(
-            query=get_template_query,
-            params=(id,),
+        templates = await catalog_cache.get_templates_by_id(
+            template_ids=[id],
             request_id=request_id,
-            connection=conn,
         )
 
-        if not template:
+        if id not in templates:
             logger.error(f"The template id {id} does not exist")
             return JSONResponse(
                 content={"message": f"Template with ID {id} does not exist"},
                 status_code=404,
             )
 
-        return JSONResponse(content=template, status_code=200)
+        template = templates[id]
+        template.pop("rule_list", None)
+
+        return JSONResponse(content=[template], status_code=200)
+
+    except PoolExhaustedError:
+        raise
 
     except Exception as e:
         logger.error(f"Failed to retrieve template with id {id}: {str(e)}")
@@ -131,22 +201,6 @@ async def create_template(
     # Create template id
     id = str(uuid.uuid4())
 
-    create_template_query = """
-        INSERT INTO templates (id, name, description, field, prompt)
-        VALUES ($1, $2, $3, $4, $5)
-    """
-
-    create_template_rule_mapping_query = """
-        INSERT INTO template_rule_mapping (template_id, rule_id)
-        VALUES ($1, $2)
-    """
-
-    check_existing_template_name_query = """
-        SELECT id
-        FROM templates
-        WHERE name = $1
-    """
-
     try:
         name = request.name
         description = request.description
@@ -163,7 +217,7 @@ async def create_template(
 
         # Check if template name already exists in database
         existing_template = await execute_query(
-            query=check_existing_template_name_query,
+            query=CHECK_EXISTING_TEMPLATE_NAME_QUERY,
             params=(name,),
             request_id=request_id,
             connection=conn,
@@ -176,33 +230,39 @@ async def create_template(
                 status_code=400,
             )
 
-        await execute_query(
-            query=create_template_query,
-            params=(
-                id,
-                name,
-                description,
-                json.dumps(field),
-                prompt,
-            ),
-            request_id=request_id,
-            connection=conn,
-        )
+        async with conn.transaction():
+            await execute_query(
+                query=CREATE_TEMPLATE_QUERY,
+                params=(
+                    id,
+                    name,
+                    description,
+                    field,
+                    prompt,
+                ),
+                request_id=request_id,
+                connection=conn,
+            )
 
-        if len(rule_ids) > 0:
-            for rule_id in rule_ids:
+            if len(rule_ids) > 0:
                 await execute_query(
-                    query=create_template_rule_mapping_query,
-                    params=(id, rule_id),
+                    query=ADD_TEMPLATE_RULE_MAPPINGS_QUERY,
+                    params=(id, rule_ids),
                     request_id=request_id,
                     connection=conn,
                 )
 
+        # Invalidate cached templates and rules in every worker
+        await notify_catalog_changed(request_id=request_id, connection=conn)
+
         return JSONResponse(
             content={"message": f"Successfully created template {name}"},
             status_code=201,
         )
 
+    except PoolExhaustedError:
+        raise
+
     except Exception as e:
         logger.error(f"Failed to create {request.name}: {str(e)}")
         return JSONResponse(
@@ -220,35 +280,6 @@ async def update_template(
 ):
     """Edit a template by ID"""
 
-    update_template_query = """
-        UPDATE templates
-        SET name = $1, description = $2, field = $3, prompt = $4
-        WHERE id = $5
-    """
-
-    create_template_rule_mapping_query = """
-        INSERT INTO template_rule_mapping (template_id, rule_id)
-        VALUES ($1, $2)
-    """
-
-    check_existing_template_name_query = """
-        SELECT name
-        FROM templates
-        WHERE name = $1 AND id != $2
-    """
-
-    check_existing_template_id_query = """
-        SELECT id
-        FROM templates
-        WHERE id = $1
-    """
-
-    check_existing_rule_ids_query = """
-        SELECT template_id, rule_id
-        FROM template_rule_mapping
-        WHERE template_id = $1 AND rule_id = $2
-    """
-
     try:
         if not id:
             logger.error("Error in editing template: template id must not be empty")
@@ -260,7 +291,7 @@ async def update_template(
             )
 
         existing_template = await execute_query(
-            query=check_existing_template_id_query,
+            query=CHECK_EXISTING_TEMPLATE_ID_QUERY,
             params=(id,),
             request_id=request_id,
             connection=conn,
@@ -287,7 +318,7 @@ async def update_template(
 
         # Check if template exists in database
         existing_template = await execute_query(
-            query=check_existing_template_name_query,
+            query=CHECK_DUPLICATE_TEMPLATE_NAME_QUERY,
             params=(name, id),
             request_id=request_id,
             connection=conn,
@@ -300,34 +331,38 @@ async def update_template(
                 status_code=400,
             )
 
-        if len(rule_ids) > 0:
-            for rule_id in rule_ids:
-                # Check if the mapping already exists
-                existing_mapping = await execute_query(
-                    query=check_existing_rule_ids_query,
-                    params=(id, rule_id),
-                    request_id=request_id,
-                    connection=conn,
-                )
+        # Apply the template and its rule mappings as one diff
+        async with conn.transaction():
+            await execute_query(
+                query=UPDATE_TEMPLATE_QUERY,
+                params=(name, description, field, prompt, id),
+                request_id=request_id,
+                connection=conn,
+            )
 
-                # Only create mapping if it doesn't already exist
-                if not existing_mapping:
-                    await execute_query(
-                        query=create_template_rule_mapping_query,
-                        params=(id, rule_id),
-                        request_id=request_id,
-                        connection=conn,
-                    )
+            await execute_query(
+                query=ADD_TEMPLATE_RULE_MAPPINGS_QUERY,
+                params=(id, rule_ids),
+                request_id=request_id,
+                connection=conn,
+            )
 
-        await execute_query(
-            query=update_template_query,
-            params=(name, description, json.dumps(field), prompt, id),
-            request_id=request_id,
-            connection=conn,
-        )
+            # Drop the mappings of rules no longer listed
+            await execute_query(
+                query=DELETE_STALE_TEMPLATE_RULE_MAPPINGS_QUERY,
+                params=(id, rule_ids),
+                request_id=request_id,
+                connection=conn,
+            )
+
+        # Invalidate cached templates and rules in every worker
+        await notify_catalog_changed(request_id=request_id, connection=conn)
 
         return Response(status_code=204)
 
+    except PoolExhaustedError:
+        raise
+
     except Exception as e:
         logger.exception(
             f"Unexpected error occurred while editing template {id}: {str(e)}"
@@ -346,26 +381,10 @@ async def delete_template(
 ):
     """Delete a template by ID"""
 
-    check_existing_template_name_query = """
-        SELECT id
-        FROM templates
-        WHERE id = $1
-    """
-
-    delete_template_query = """
-        DELETE FROM templates
-        WHERE id = $1
-    """
-
-    delete_template_rule_mapping_query = """
-        DELETE FROM template_rule_mapping
-        WHERE template_id = $1
-    """
-
     try:
         # Check if template exists in database
         existing_template = await execute_query(
-            query=check_existing_template_name_query,
+            query=CHECK_EXISTING_TEMPLATE_ID_QUERY,
             params=(id,),
             request_id=request_id,
             connection=conn,
@@ -378,21 +397,27 @@ async def delete_template(
             )
 
         await execute_query(
-            query=delete_template_query,
+            query=DELETE_TEMPLATE_QUERY,
             params=(id,),
             request_id=request_id,
             connection=conn,
         )
 
         await execute_query(
-            query=delete_template_rule_mapping_query,
+            query=DELETE_TEMPLATE_RULE_MAPPING_QUERY,
             params=(id,),
             request_id=request_id,
             connection=conn,
         )
 
+        # Invalidate cached templates and rules in every worker
+        await notify_catalog_changed(request_id=request_id, connection=conn)
+
         return Response(status_code=204)
 
+    except PoolExhaustedError:
+        raise
+
     except Exception as e:
         logger.error(f"Failed to delete template id {id}: {str(e)}")
         return JSONResponse(
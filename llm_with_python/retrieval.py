@@ -1,8 +1,51 @@
+import os
+import time
 import boto3
+import threading
+from collections import OrderedDict
 from botocore.exceptions import ClientError
 
 from config import region, config, model
 
+# Lifetime of the URLs signed on a cache miss, or the requested lifetime if
+# longer. Same setting as the backend's presign cache, with a default above
+# the 7200 seconds retrievals ask for so signed URLs can be reused
+PRESIGN_EXPIRES_IN = int(os.getenv("PRESIGN_EXPIRES_IN", 14400))
+# Upper bound on cached URLs; the least recently used are evicted first
+PRESIGNED_URL_CACHE_SIZE = 10000
+
+
+class PresignedUrlCache:
+    """Thread-safe LRU cache of presigned URLs keyed on (bucket, key)."""
+
+    def __init__(self, max_size=PRESIGNED_URL_CACHE_SIZE, expires_in=PRESIGN_EXPIRES_IN):
+        self.max_size = max_size
+        self.expires_in = expires_in
+        # (bucket, key) -> (url, monotonic expiry)
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lifetime(self, expiration):
+        """Lifetime to sign a miss for, so it can serve later requests."""
+        return max(self.expires_in, expiration)
+
+    def get(self, bucket_name, object_name, expiration):
+        """Get a cached URL valid for at least expiration seconds."""
+        valid_until = time.monotonic() + expiration
+        with self._lock:
+            entry = self._urls.get((bucket_name, object_name))
+            if not entry or entry[1] < valid_until:
+                return None
+            self._urls.move_to_end((bucket_name, object_name))
+            return entry[0]
+
+    def put(self, bucket_name, object_name, url, expires_at):
+        with self._lock:
+            self._urls[(bucket_name, object_name)] = (url, expires_at)
+            self._urls.move_to_end((bucket_name, object_name))
+            while len(self._urls) > self.max_size:
+                self._urls.popitem(last=False)
+
 
 class Retrieval:
     """Retrieve context from Amazon Bedrock Knowledge Base"""
@@ -18,6 +61,11 @@ class Retrieval:
         region_name=region.AP_SOUTHEAST_1,
     )
 
+    # One S3 client and presigned URL cache shared by every retrieval
+    s3_client = None
+    s3_client_lock = threading.Lock()
+    presigned_urls = PresignedUrlCache()
+
     def _create_client(
         self,
         service_name: str = "bedrock-agent-runtime",
@@ -73,18 +121,34 @@ class Retrieval:
         bucket_name, object_key = s3_uri.split("/", 1)
         return bucket_name, object_key
 
-    # Create the presigned for single link
+    # Get the S3 client, created once and shared (boto3 clients are thread safe)
+    @classmethod
+    def _get_s3_client(cls):
+        with cls.s3_client_lock:
+            if cls.s3_client is None:
+                cls.s3_client = boto3.client("s3")
+            return cls.s3_client
+
+    # Create the presigned for single link, reusing a cached one when possible
     def _create_presigned_url(self, bucket_name, object_name, expiration=7200):
+        cached = self.presigned_urls.get(bucket_name, object_name, expiration)
+        if cached:
+            return cached
+
+        # Measured before signing so the expiry is never overestimated
+        now = time.monotonic()
+        lifetime = self.presigned_urls.lifetime(expiration)
+
         # Generate a presigner uRL for the S3 Object
-        s3_client = boto3.client("s3")
         try:
-            response = s3_client.generate_presigned_url(
+            response = self._get_s3_client().generate_presigned_url(
                 "get_object",
                 Params={"Bucket": bucket_name, "Key": object_name},
-                ExpiresIn=expiration,
+                ExpiresIn=lifetime,
             )
         except ClientError as e:
             return None
+        self.presigned_urls.put(bucket_name, object_name, response, now + lifetime)
         return response
 
     # Generate links for a list of uri
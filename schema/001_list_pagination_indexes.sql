@@ -0,0 +1,24 @@
+-- Composite indexes backing keyset pagination and filters on the list endpoints.
+-- Ids are ordered under the "C" collation, as the list queries order them
+-- (see core/pagination.py).
+
+CREATE INDEX IF NOT EXISTS idx_documents_updated_at_id
+    ON documents (updated_at DESC, id COLLATE "C" DESC);
+
+CREATE INDEX IF NOT EXISTS idx_documents_status_updated_at_id
+    ON documents (status, updated_at DESC, id COLLATE "C" DESC);
+
+CREATE INDEX IF NOT EXISTS idx_documents_template_id_updated_at_id
+    ON documents (template_id, updated_at DESC, id COLLATE "C" DESC);
+
+CREATE INDEX IF NOT EXISTS idx_documents_transaction_id_updated_at_id
+    ON documents (transaction_id, updated_at DESC, id COLLATE "C" DESC);
+
+CREATE INDEX IF NOT EXISTS idx_rules_created_at_id
+    ON rules (created_at DESC, id COLLATE "C" DESC);
+
+CREATE INDEX IF NOT EXISTS idx_rules_rule_type_created_at_id
+    ON rules (rule_type, created_at DESC, id COLLATE "C" DESC);
+
+CREATE INDEX IF NOT EXISTS idx_templates_created_at_id
+    ON templates (created_at DESC, id COLLATE "C" DESC);
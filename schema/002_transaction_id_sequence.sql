@@ -0,0 +1,8 @@
+-- Sequence backing transaction ids. Every nextval reserves a block of 100 ids
+-- for one worker (see core/transaction_ids.py). Values start above the 5-digit
+-- range of the legacy random ids so the two can never collide.
+
+CREATE SEQUENCE IF NOT EXISTS transaction_id_seq
+    START WITH 100000
+    MINVALUE 100000
+    INCREMENT BY 100;
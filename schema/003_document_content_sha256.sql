@@ -0,0 +1,4 @@
+-- SHA-256 of each raw file, computed while it is streamed to S3
+-- (see core/uploads.py). Null for documents uploaded before this column existed.
+
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_sha256 VARCHAR(64);
@@ -0,0 +1,24 @@
+-- Flow runs being monitored, so monitoring survives restarts. Each worker
+-- leases the runs it polls (see core/flow_scheduler.py). Runs whose lease
+-- expired or was released are claimed by another worker.
+
+CREATE TABLE IF NOT EXISTS flow_runs (
+    flow_run_id VARCHAR(255) PRIMARY KEY,
+    flow_id VARCHAR(255) NOT NULL,
+    transaction_id VARCHAR(255) NOT NULL,
+    status VARCHAR(50),
+    next_poll_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    lease_owner VARCHAR(255),
+    lease_expires_at TIMESTAMP WITH TIME ZONE,
+    completed_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_flow_runs_active_next_poll_at
+    ON flow_runs (next_poll_at)
+    WHERE completed_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_flow_runs_active_lease_owner
+    ON flow_runs (lease_owner)
+    WHERE completed_at IS NULL;
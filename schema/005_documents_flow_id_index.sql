@@ -0,0 +1,5 @@
+-- Index backing the status and quality updates, which look documents up by
+-- flow_id (and file name) instead of scanning the table.
+
+CREATE INDEX IF NOT EXISTS idx_documents_flow_id_name
+    ON documents (flow_id, name);
@@ -0,0 +1,4 @@
+-- Page-level quality metrics of each document, stored when its flow succeeds
+-- so they can be served without reading quality.json from S3.
+
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS page_quality JSONB;
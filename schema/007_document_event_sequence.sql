@@ -0,0 +1,4 @@
+-- Ids of document events streamed over Server-Sent Events (see core/events.py).
+-- Shared by every worker so a client can resume from Last-Event-ID on any of them.
+
+CREATE SEQUENCE IF NOT EXISTS document_event_seq;
@@ -0,0 +1,25 @@
+-- Uploads waiting for their flow to be created and executed, so ingestion
+-- survives restarts. Each worker leases the jobs it runs (see
+-- core/ingestion.py). Jobs whose lease expired or was released are claimed
+-- by another worker.
+
+CREATE TABLE IF NOT EXISTS ingestion_jobs (
+    transaction_id VARCHAR(255) PRIMARY KEY,
+    template_ids TEXT[] NOT NULL,
+    flow_id VARCHAR(255),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    lease_owner VARCHAR(255),
+    lease_expires_at TIMESTAMP WITH TIME ZONE,
+    completed_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_active_created_at
+    ON ingestion_jobs (created_at)
+    WHERE completed_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_active_lease_owner
+    ON ingestion_jobs (lease_owner)
+    WHERE completed_at IS NULL;
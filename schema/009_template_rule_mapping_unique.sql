@@ -0,0 +1,12 @@
+-- One mapping per template and rule, so mapping changes can be applied with
+-- INSERT ... ON CONFLICT DO NOTHING. Duplicates left by earlier versions are
+-- removed first. The unique index also serves lookups by template.
+
+DELETE FROM template_rule_mapping a
+USING template_rule_mapping b
+WHERE a.ctid < b.ctid
+  AND a.template_id = b.template_id
+  AND a.rule_id = b.rule_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_template_rule_mapping_template_id_rule_id
+    ON template_rule_mapping (template_id, rule_id);
@@ -0,0 +1,9 @@
+-- Progress of the flow execution of each ingestion job, so a reclaimed job
+-- never executes its flow a second time. execute_started_at is set before
+-- the flow service is called, executed_at once it answered.
+
+ALTER TABLE ingestion_jobs
+    ADD COLUMN IF NOT EXISTS execute_started_at TIMESTAMP WITH TIME ZONE,
+    ADD COLUMN IF NOT EXISTS executed_at TIMESTAMP WITH TIME ZONE,
+    ADD COLUMN IF NOT EXISTS flow_run_id VARCHAR(255),
+    ADD COLUMN IF NOT EXISTS flow_status VARCHAR(50);